@@ -1,32 +1,77 @@
+import codecs
 import logging
-import re
-import boto3
 import uuid
-from botocore.client import Config
-from pandas import concat, json_normalize
-import synapseclient
-import json
 from botocore.exceptions import ClientError, EventStreamError
 from urllib3.exceptions import ReadTimeoutError
 
 import os
-
-syn = synapseclient.Synapse()
-syn.login()
-
-region_name = "us-east-1"
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from bedrock import BedrockConfig, make_client
+from ledger import RunLedger, IN_PROGRESS, DONE, FAILED
+from extraction import extract_json_response, parse_observations
+from observations import to_dataframe, to_records
+from prompts import estimate_size, render_followup, render_header, render_query, size_report
+from sinks import make_sink
+from tools_table import load_tools_table
+from convergence import ConvergenceDetector
+from throttle import AdaptiveConcurrency, RetryBudget, TokenBucket, call_with_retry
+
+# number of resources extracted at once; each resource runs in its own agent session
+max_concurrency = int(os.environ.get("NFTC_MAX_CONCURRENCY", "4"))
+
+# limits shared by every worker: a request rate, an AIMD cap on calls in flight that backs off when
+# Bedrock throttles, and a total number of retries for the whole run
+rate_limiter = TokenBucket(rate=float(os.environ.get("NFTC_REQUESTS_PER_SECOND", "1")), capacity=max_concurrency)
+concurrency_limiter = AdaptiveConcurrency(maximum=max_concurrency)
+retry_budget = RetryBudget(int(os.environ.get("NFTC_RETRY_BUDGET", "200")))
+
+# end a session once fewer than this share of a turn's observations are new, for NFTC_PATIENCE turns in a row
+min_yield = float(os.environ.get("NFTC_MIN_YIELD", "0.25"))
+patience = int(os.environ.get("NFTC_PATIENCE", "1"))
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-# Connect to AWS Bedrock
-session = boto3.Session(
-aws_access_key_id='abc',
-aws_secret_access_key='xyz',
-aws_session_token='123'
-)
+# boto3 clients are thread-safe, but the connection pool has to be large enough for every worker;
+# NFTC_BEDROCK_ENDPOINT_URL points it at a local stand-in such as fake_bedrock.py instead of AWS
+bedrock_config = BedrockConfig.from_environment(max_pool_connections=max(max_concurrency, 10))
+# botocore's own retries are turned off so that throttling reaches the shared limiter
+bedrock_agent_client = make_client(bedrock_config, retries={'total_max_attempts': 1})
+
+def iter_completion(completion_stream):
+    # decode the chunk bytes incrementally, so a multi-byte character split across two chunks comes out intact
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    for event in completion_stream:
+        # with enableTrace the stream also carries trace events, which have no text
+        if "chunk" not in event:
+            continue
+        text = decoder.decode(event["chunk"]["bytes"])
+        if text:
+            yield text
+    text = decoder.decode(b"", final=True)
+    if text:
+        yield text
+
+
+def read_completion(completion_stream, stop_at="</json_response>"):
+    # join the streamed text once at the end, and stop reading as soon as stop_at has arrived
+    parts = []
+    tail = ""
+    for text in iter_completion(completion_stream):
+        parts.append(text)
+        if stop_at is None:
+            continue
+        # the tag itself may be split across chunks, so check it against the end of the previous chunk too
+        window = tail + text
+        if stop_at in window:
+            close = getattr(completion_stream, "close", None)
+            if close is not None:
+                close()
+            break
+        tail = window[-(len(stop_at) - 1):]
+    return "".join(parts)
 
-bedrock_agent_client = session.client("bedrock-agent-runtime", region_name=region_name)
 
 def invokeAgent(input, agentAliasId, agentId, sessionId=None, enableTrace=False, endSession=True):
 
@@ -36,7 +81,7 @@ def invokeAgent(input, agentAliasId, agentId, sessionId=None, enableTrace=False,
     if sessionId is not None:
         endSession = False
 
-    try:
+    def invoke():
         response = bedrock_agent_client.invoke_agent(
             agentAliasId=agentAliasId,
             agentId=agentId,
@@ -46,10 +91,11 @@ def invokeAgent(input, agentAliasId, agentId, sessionId=None, enableTrace=False,
             sessionId=sessionId
         )
         
-        completion = ""
-        for event in response.get("completion"):
-            chunk = event["chunk"]
-            completion = completion + chunk["bytes"].decode()
+        # throttling can also arrive mid-stream as an EventStreamError, so reading the stream is part of the retried call
+        return read_completion(response.get("completion"))
+
+    try:
+        completion = call_with_retry(invoke, bucket=rate_limiter, limiter=concurrency_limiter, budget=retry_budget)
 
     except (ClientError, EventStreamError, ReadTimeoutError, TimeoutError) as e:
         logger.error(f"Couldn't invoke agent. {e}")
@@ -60,106 +106,147 @@ def invokeAgent(input, agentAliasId, agentId, sessionId=None, enableTrace=False,
 
     return completion
     
-## Get table data from synapse SELECT resourceId, resourceName, synonyms FROM syn26450069 where resourceType is Animal Model or Cell Line
-query = "SELECT resourceId, resourceName, resourceType, rrid, synonyms FROM syn26450069 where resourceType in ('Animal Model', 'Cell Line')"
-results = syn.tableQuery(query, includeRowIdAndRowVersion=False)
-resultsdf = results.asDataFrame()
-
 def generate_and_invoke_query(row, agentAliasId, agentId, enableTrace=False):
 
-    query = "Please extract a comprehensive set of highly-accurate observations about '{}'".format(row['resourceName'])
-    if row['resourceType']:
-        query += ", a {}".format(row['resourceType'])
-    if row['synonyms']:
-         query += ", also known as {}".format(row['synonyms'])
-    if row['resourceId']:
-        query += ", resourceId: {}".format(row['resourceId'])
-    if isinstance(row['rrid'], str) and row['rrid'] != 'nan':
-        query += ", RRID:{}. ".format(row["rrid"])
+    header = render_header(row)
+    print(header)
 
-    print(query)
+    prompt_size = estimate_size(header)
+    print(f"prompt size: {prompt_size.bytes} bytes, ~{prompt_size.tokens} tokens")
 
-    query += '. The RRID might not be mentioned in the search results. Also, the RRID is not the same as the resourceId. The resourceId is an etag and will be provided in the query. Most importantly PLEASE be sure that any observations extracted are relevant to the named resource. False negatives (i.e. missing an observation) are acceptable for now, false positives (i.e. observations attributed to the wrong resource or DOI) are not acceptable. Do not invent synonyms for cell lines or animal models that I have not explicitly provided, with the few exceptions I mention later in these instructions. Please be ABSOLUTELY SURE that the observation matches the resource. For example, if a cell line like SK-MEL-238 is queried, and the search results mention SK-MEL-2 or SK-MEL-131, these are probably not observations about SK-MEL-238 or SK-MEL-181. Or, if the search results do not explicitly mention the resource (e.g. STS-26T, or SZ-NF4 are in the query but not in the search results), then those search results probably do not contain relevant observations and should be ignored. Or, sometimes, author initials or other acronyms can be confused for a resource (e.g. cell line SZ-NF4 and author initials SZ). On the other hand, sometimes papers may mention the full name of the resource once and then refer to it thereafter using an abbrevation, particularly in the case of animal models (e.g. B6;129S2-Trp53tm1Tyj Nf1tm1Tyj/J is also known as NPcis). In that specific instance, it is OK to extract observations that do not have a perfect name match with the query resource. Similarly, sometimes there are minor differences in punctuation, spacing, or capitalization (e.g. FTC133 vs FTC-133, YST1 vs YST-1, or U87-MG vs U87MG vs U87 MG or sNF94.3 vs SNF94.3, many other examples exist); these should be treated as identical resources. If a resourceName or synonym is extremely generic - for example, Nf1+/- or NF1-mut or NF1-null or similar, do not include it in the knowledgebase search and do not extract observations about it, because it is possible that the search results are talking about a different animal model or cell line. DO NOT include observations where the focus is methodology, acknowledgements, ethics, culture conditions, quality control (e.g. <example>the cell lines were sequenced with whole genome sequencing</example>, or the <example>the cell lines were acquired from...</example>, or <example>The mouse genotypes were verified by PCR.</example>, or <example>The mice were evaluated twice daily.</example> or <example>the cell line was confirmed to be negative for mycoplasma contamination</example> or <example></example>). We are only interested in observations that are data-driven and scientific in origin. DO NOT include observations that do not match the input resource name or describe a different cell line or mouse model. Be absolutely sure that your extracted observations are accurate for a particular resource. It is not acceptable to hallucinate or make up observations. Please be sure to retrieve the "doi" portion of your response from the metadata associated with the chunk from which the observation was extracted. DO NOT make up a DOI. DO NOT respond in any format other than the requested JSON format. Missing values (for example, if the observationTime is not applicable), fill it in with a "" to make sure it is valid JSON. 000-If you do not find any relevant observations for the query resource in the search results, or there is nothing to extract, simply return [null]; do not extract anything in the "observation" format. DO NOT include any preamble to the JSON or text after the JSON. The JSON portion of your response must be valid JSON, readable in python by the json library. Be sure to wrap the JSON portion of your response in <json_response> </json_response> tags. The observations you extract should be summarized, and succinct, but we are interested in all scientific observations about the resource; even if they are complex or jargon-heavy topics, please still extract them. Here are some examples: <example_1> For the query "NF1OPG, an Animal Model, resource ID 76ff3bea-5a2c-4d9c-b3c4-513842c11af4", given the search result: <example_search_result> retrievedReferences": [{"content": {"text": "Nf1OPG mice with optic glioma tumors consistently developed preneoplastic lesions by 3 months of age that progressed to optic gliomas over the next 3 to 6 months. By 7–9 months of age, 100% of mice had symptomatic optic glioma and required euthanasia due to progressive neurological symptoms."}, "location": {"s3Location": {"uri": "s3://nf-tools-database-publications/nftc_pdfs/nftc_10.1158_1078-0432.CCR-13-1740.pdf"}, "type": "S3"}, "metadata": {"x-amz-bedrock-kb-source-uri": "s3://nf-tools-database-publications/nftc_pdfs/nftc_10.1158_1078-0432.CCR-13-1740.pdf", "doi": ["https://doi.org/10.1158/1078-0432.CCR-13-1740"]}} </example_search_result> <example_response> <json_response> [{"resourceId":"76ff3bea-5a2c-4d9c-b3c4-513842c11af4","resourceName":"NF1OPG","resourceType":["Animal Model"],"observationText":"In the NF1OPG mouse model, preneoplastic lesions consistently developed by 3 months of age and progressed to symptomatic optic gliomas requiring euthanasia by 7-9 months due to neurological symptoms in 100% of mice.","observationType":["Tumor progression","Neurological symptoms"],"observationPhase":"juvenile","observationTime":3,"observationTimeUnits":"months","doi":"https://doi.org/10.1158/1078-0432.CCR-13-1740"}] </json_response> </example_response> </example_1> <example_2> For the query "NF1 flox/flox; GFAP-Cre, an Animal Model, resource ID d2173c46-0d4d-4b79-bcdf-ceb6d05b5a3f", given the search result: <example_search_result> retrievedReferences": [{"content": {"text": "Mice with astroglial inactivation of the Nf1 tumor suppressor gene (Nf1 flox/flox; GFAP-Cre mice) developed low-grade astrocytomas with 100% penetrance. These low-grade gliomas were detected as early as 3 months of age, and the mice exhibited progressive neurological dysfunction with advanced age."}, "location": {"s3Location": {"uri": "s3://nf-tools-database-publications/nftc_pdfs/nftc_10.1158_0008-5472.CAN-05-0677.pdf"}, "type": "S3"}, "metadata": {"x-amz-bedrock-kb-source-uri": "s3://nf-tools-database-publications/nftc_pdfs/nftc_10.1158_0008-5472.CAN-05-0677.pdf", "doi": ["https://doi.org/10.1158/0008-5472.CAN-05-0677"]}} </example_search_result> <example_response> <json_response> [{"resourceId":"d2173c46-0d4d-4b79-bcdf-ceb6d05b5a3f","resourceName":"NF1 flox/flox; GFAP-Cre","resourceType":["Animal Model"],"observationText":"These mice developed low-grade astrocytomas with 100% penetrance starting as early as 3 months of age, exhibiting progressive neurological dysfunction with increasing age.","observationType":["Tumor incidence","Neurological symptoms"],"observationPhase":"juvenile","observationTime":3,"observationTimeUnits":"months","doi":"https://doi.org/10.1158/0008-5472.CAN-05-0677"}] </json_response> </example_response> </example_2> <example_3> For the query "T265, a Cell Line, resourceId 6419dd0d-1937-4ecf-bf01-876632ae0f54", given the search result: <example_search_result> retrievedReferences": [{"content": {"text": "Then we performed a human STR authentication analysis to identify any possible cross-contamination or misidentification among cell lines of human origin (Table S1). All STR profiles matched the STR profiles published in Cellosaurus and ATCC when available. However, in this process, we identified the same STR profile for ST88-14 and T265 cell lines (Data S2) in all ST88-14- and T265-related samples provided by different laboratories. To find out which cell line was misidentified we analyzed the oldest ST88-14 and T265 stored vials in their original labs and more conclusively, the primary tumor from which the ST88-14 cell line was isolated (Data S2). We identified the ST88-14 cell line as the genuine cell line for that STR profile, NF1 germline (c.1649dupT) mutation and somatic copy number alteration landscape, and dismissed the use of the T265 cell line, which we assume was misidentified at some point after its establishment and expansion."}, "location": {"s3Location": {"uri": "s3://nf-tools-database-publications/nftc_pdfs/nftc_10.1016.j.isci.2023.106096.pdf"}, "type": "S3"}, "metadata": {"x-amz-bedrock-kb-source-uri": "s3://nf-tools-database-publications/nftc_pdfs/nftc_10.1016.j.isci.2023.106096.pdf", "doi": ["https://www.doi.org/10.1016/j.isci.2023.106096"]}} </example_search_result> <example_response> <json_response> [{"resourceId":"6419dd0d-1937-4ecf-bf01-876632ae0f54","resourceName":"T265","resourceType":["Cell Line"],"observationText":"The T265 cell line was discarded as it exhibited the same STR profile as the ST88-14 and its matched primary MPNST, suggesting it may not be a distinct cell line but rather a duplicate or misidentified version of ST88-14.","observationType":["Cell line identity"],"observationPhase":"","observationTime":,"observationTimeUnits":"","doi":"https://www.doi.org/10.1016/j.isci.2023.106096"}] </json_response> </example_response> </example_3> Note that example_3 could also be a valid search result for ST88-14. <example_4> For the query "NF90-8, a Cell Line, resourceId 0f404e70-2acf-4877-bcd5-6da81d9fa41e", given the search result: <example_search_result> retrievedReferences": [{"content": {"text": "The functional impact of small variants in oncogenes and TSGs was also moderate. We identified some MPNST-related genes inactivated by pathogenic SNVs (Figure 4B and Table S3). In addition to germline NF1 mutations, somatic mutations also affected NF1, as well as other genes including TP53, PRC2 genes, and PTEN. Remarkably, we did not identify gain-of-function mutations in oncogenes, except a BRAF V600E mutation in the STS-26T cell line. In contrast, we identified gains in genomic regions containing receptors, especially a highly gained region containing PDGFRA and KIT in two NF1-related cell lines (S462 and NF90-8) (Figure 4B). The most frequently inactivated gene in our set of cell lines was CDKN2A, a known bottleneck for MPNST development.19,20 The fact that this gene was inactivated by a point mutation only in one cell line, exemplifies the relatively low functional impact of small variants compared to structural variants in MPNST initiation."}, "location": {"s3Location": {"uri": "s3://nf-tools-database-publications/nftc_pdfs/nftc_10.1016.j.isci.2023.106096.pdf"}, "type": "S3"}, "metadata": {"x-amz-bedrock-kb-source-uri": "s3://nf-tools-database-publications/nftc_pdfs/nftc_10.1016.j.isci.2023.106096.pdf", "doi": ["https://www.doi.org/10.1016/j.isci.2023.106096"]}} </example_search_result> <example_response> <json_response> [{"resourceId":"0f404e70-2acf-4877-bcd5-6da81d9fa41e","resourceName":"NF90-8","resourceType":["Cell Line"],"observationText":"The NF90-8 cell line had a highly gained region in chromosome 4 containing the PDGFRA and KIT receptors.","observationType":["Genomics"],"observationPhase":"","observationTime":,"observationTimeUnits":"","doi":"https://www.doi.org/10.1016/j.isci.2023.106096"}] </json_response> </example_response> </example_4>'
+    query = render_query(header)
 
     sessionId = str(uuid.uuid4())
+    detector = ConvergenceDetector(min_yield=min_yield, patience=patience)
+    # observations from every turn are collected as records and turned into a data frame once at the end
+    observations = []
     
-    for _ in range(100):
-        # for the first loop, invoke the agent as is and convert the response to a data frame
-        if _ == 0:
+    for turn in range(100):
+        # for the first loop, invoke the agent as is and collect the observations
+        if turn == 0:
             first_response = invokeAgent(query, agentAliasId, agentId, sessionId, enableTrace, endSession=False)
 
             #extract text between <json_response> and </json_response> tags
-            first_response = first_response[first_response.find("<json_response>") + len("<json_response>"):first_response.find("</json_response>")]
+            first_response = extract_json_response(first_response)
             print(first_response)
 
-            if first_response.strip() == '[null]' or first_response.strip() == 'null' or first_response.strip() == '' or first_response.strip() == '[]':
-                print('response is null, likely no observations to extract')
-                response = json_normalize({})
+            if first_response is None:
+                print('response has no <json_response> block, likely no observations to extract')
                 break
 
-            try:
-                response = json_normalize(json.loads(first_response))
-            except:
-                print('response is not json, likely no observations to extract')
-                response = json_normalize({})
+            #keep every object that parses, even if others in the array are malformed
+            objects, errors = parse_observations(first_response)
+            for error in errors:
+                print(f'skipping unparseable observation {error.index}: {error.message}')
+            records = to_records(objects)
+
+            if not records:
+                print('response is null or not json, likely no observations to extract')
                 break
 
+            observations.extend(records)
+            detector.update(records)
+
         else:
             # for subsequent loops, modify the input to prompt the agent to continue extracting observations about the same resource
-            query = "Those observations are great. I would like more unique and highly-accurate observations. I am not interested in observations that convey the same or nearly the same information as what you already shared. Tell me some additional, not previously mentioned observations about {}. Please be sure to follow all the instructions in my first prompt, and most importantly please be sure that any observations extracted are relevant to the named resource. False negatives are acceptable for now, false positives (i.e. observations attributed to the wrong resource or DOI) are not acceptable.".format(row['resourceName'])
-            # if row['resourceType']:
-            #     query += ", a {}".format(row['resourceType'])
-            # if row['synonyms']:
-            #      query += ", also known as {}".format(row['synonyms'])
-            # query += ", resource ID {}. DO NOT include observations that are the same fact as a previous observation, even if phrased differently.  DO NOT include observations where the primary focus is methodology (e.g. <example>the cell lines were sequenced with whole genome sequencing</example>, or the <example>the cell lines were acquired from...</example>,), or acknowledgements. DO NOT include observations that do not match the input resource name or describe a different cell line or mouse model, even if it is a slight variant.Please be sure to retrieve the 'doi' portion of your response from the metadata associated with the chunk from which the observation was extracted. DO NOT respond in any format other than the requested JSON format. DO NOT include any preamble to the JSON or text after the JSON.  Be sure to wrap the JSON portion of your response in <json_response> </json_response> tags.".format(row['resourceId'])
+            query = render_followup(row)
 
             response_addl = invokeAgent(query, agentAliasId, agentId, sessionId, enableTrace, endSession=False)
             
             #extract text between <json_response> and </json_response> tags
-            response_addl = response_addl[response_addl.find("<json_response>") + len("<json_response>"):response_addl.find("</json_response>")]
+            response_addl = extract_json_response(response_addl)
             print(response_addl)
 
-            # if response is 'null' break the loop
-            if response_addl.strip() == '[null]' or response_addl.strip() == 'null' or response_addl.strip() == '' or response_addl.strip() == '[]':
-                print('response is null, likely no more observations to extract')
-                break
-
-            #check if the response is json format, if so, convert to a data frame and append it to the response data frame, if not, break the loop
-            try:
-                response_addl = json_normalize(json.loads(response_addl))
-            except:
-                print('response is not json, likely no more observations to extract')
+            if response_addl is None:
+                print('response has no <json_response> block, likely no more observations to extract')
                 break
 
-            response = concat([response, response_addl], ignore_index=True)
-    
-    try:
-        print(response)
-        return response
-        
-    except:
-        response = json_normalize({})
-
-
-#test the function on a single row
-# row = resultsdf.sample(1).iloc[0]
-# response = generate_and_invoke_query(row, agentAliasId="1WW2I8WCXL", agentId="RMYQ6X4RLO")
-# print(response)
+            #keep every object that parses; if nothing does (including 'null' or '[null]'), break the loop
+            objects, errors = parse_observations(response_addl)
+            for error in errors:
+                print(f'skipping unparseable observation {error.index}: {error.message}')
+            records = to_records(objects)
 
-## create output directory
-os.makedirs('/Users/rallaway/Documents/GitHub/nftc-llm/nftc_observations', exist_ok=True)
+            if not records:
+                print('response is null or not json, likely no more observations to extract')
+                break
 
-#run the function on rows, and write each response to a csv file, save as observation_<resourceId>.csv
-responses = json_normalize({})
-# sessionId_input = str(uuid.uuid4())
-start_resourceId = '02dacc42-ea46-48fb-a4df-7a875d801086'
-start_index = resultsdf[resultsdf['resourceId'] == start_resourceId].index[0]
+            observations.extend(records)
 
-for i, row in resultsdf.iloc[start_index:].iterrows():
-    resourceId = row['resourceId']
+            # stop once the agent is mostly repeating observations it already gave
+            new = detector.update(records)
+            if detector.converged:
+                print(f'only {new} new observations in turn {turn + 1}, likely no more observations to extract')
+                break
+    
+    response = to_dataframe(observations)
+    print(response)
+    return response, turn + 1
+
+
+def existing_outputs(output_dir):
+    # (resourceId, path) for each observation_<resourceId>.csv, the files written before there was a ledger
+    for name in sorted(os.listdir(output_dir)):
+        if name.startswith('observation_') and name.endswith('.csv'):
+            yield name[len('observation_'):-len('.csv')], os.path.join(output_dir, name)
+
+
+def run_extractions(rows, agentAliasId, agentId, sink, ledger, max_workers=max_concurrency):
+    # resources already marked done in the ledger are skipped; failed and interrupted ones are run again
+    rows = rows[~rows['resourceId'].map(ledger.is_done)]
+    print(f"{len(rows)} resources to extract, ledger so far: {ledger.summary()}")
+
+    def run_one(row):
+        # the sink marks the resource done in the ledger once its observations are on disk
+        ledger.record(row['resourceId'], IN_PROGRESS)
+        response, turns = generate_and_invoke_query(row, agentAliasId=agentAliasId, agentId=agentId)
+        sink.write(row['resourceId'], response, turns=turns)
+
+    # keep up to max_workers resources in flight; each worker waits on invoke_agent independently
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(run_one, row): row['resourceId'] for _, row in rows.iterrows()}
+        for future in as_completed(futures):
+            resourceId = futures[future]
+            try:
+                future.result()
+            except Exception as e:
+                print(f"Error occurred for resourceId {resourceId}: {str(e)}")
+                ledger.record(resourceId, FAILED, error=str(e))
+
+
+if __name__ == "__main__":
+    resultsdf = load_tools_table()
+
+    sizes = size_report(resultsdf)
+    print(f"first prompts: {sizes['tokens'].median():.0f} tokens median, {sizes['tokens'].max()} max (~{sizes['tokens'].sum()} in total)")
+
+    #test the function on a single row
+    # row = resultsdf.sample(1).iloc[0]
+    # response, turns = generate_and_invoke_query(row, agentAliasId="1WW2I8WCXL", agentId="RMYQ6X4RLO")
+    # print(response)
+
+    ## create output directory
+    output_dir = os.environ.get("NFTC_OUTPUT_DIR", '/Users/rallaway/Documents/GitHub/nftc-llm/nftc_observations')
+    os.makedirs(output_dir, exist_ok=True)
+
+    #the ledger records every resource's state, so rerunning the script resumes where the last run stopped
+    ledger_path = os.environ.get("NFTC_LEDGER", os.path.join(output_dir, '_run_ledger.jsonl'))
+    new_ledger = not os.path.exists(ledger_path)
+    ledger = RunLedger(ledger_path)
+    if new_ledger:
+        #a first run with the ledger starts from the observation_<resourceId>.csv files earlier runs left, instead of paying for them again
+        seeded = ledger.seed(existing_outputs(output_dir))
+        print(f"seeded the ledger with {seeded} resources already in {output_dir}")
+
+    #write each response to observation_<resourceId>.csv (csv) or to batched parquet files in the output directory (parquet)
+    sink = make_sink(
+        os.environ.get("NFTC_OUTPUT_FORMAT", "csv"),
+        output_dir,
+        on_written=lambda resourceId, output, turns: ledger.record(resourceId, DONE, turns=turns, output=output)
+    )
+
+    #run the function on rows
     try:
-        response = generate_and_invoke_query(row, agentAliasId="Y0EVOIL88H", agentId="RMYQ6X4RLO")
-        if response is not None:
-            response.to_csv(f'/Users/rallaway/Documents/GitHub/nftc-llm/nftc_observations/observation_{resourceId}.csv', index=False)
-    except Exception as e:
-        print(f"Error occurred for resourceId {resourceId}: {str(e)}")
+        run_extractions(resultsdf, agentAliasId="Y0EVOIL88H", agentId="RMYQ6X4RLO", sink=sink, ledger=ledger)
+    finally:
+        sink.close()
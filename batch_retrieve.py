@@ -0,0 +1,169 @@
+## runs knowledge base searches for every resource in the tools table and saves the results as a retrieval snapshot
+##
+##   python batch_retrieve.py --output snapshots/kb-2024-06            # tools table from Synapse
+##   python batch_retrieve.py --tools tools.csv --output /tmp/snapshot --workers 8 --rate 5
+##
+## the snapshot is a directory of retrievals-<run>-<part>.parquet files, one row per retrieved chunk, keyed by resourceId;
+## pandas.read_parquet(output) loads all of it. The ledger next to them (_ledger.jsonl, which Parquet readers skip) lets an interrupted run resume.
+
+import argparse
+import json
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from bedrock import BedrockConfig, build_request, get_client, make_client, retrieval_results
+from lambda_modules import build_query, name_queries, split_names
+from ledger import RunLedger, DONE, FAILED
+from sinks import PartFileWriter, import_pyarrow
+from throttle import AdaptiveConcurrency, RetryBudget, TokenBucket, call_with_retry
+from tools_table import given, load_tools_table
+
+logger = logging.getLogger(__name__)
+
+QUERY_KINDS = ("combined", "name", "synonym", "rrid")
+
+SNAPSHOT_SCHEMA = [
+    ("resourceId", "string"),
+    ("resourceName", "string"),
+    # comma-separated, for matching chunks against every name of the resource
+    ("synonyms", "string"),
+    ("queryKind", "string"),
+    ("query", "string"),
+    ("rank", "int32"),
+    ("score", "float64"),
+    ("text", "string"),
+    ("uri", "string"),
+    ("doi", "string"),
+    ("metadata", "string"),
+]
+
+
+def _cell(value):
+    # a tools table cell as the agent passes it on: strings as they are, lists (from Synapse) joined, missing ones None
+    if not given(value):
+        return None
+    return ", ".join(str(v) for v in value) if isinstance(value, (list, tuple)) else value
+
+
+def resource_parameters(row):
+    """A tools table row as the lambda's query_dict: the agent's action group parameters, lowercased."""
+    query_dict = {name.lower(): _cell(row.get(name)) for name in ("resourceName", "resourceType", "synonyms", "rrid")}
+    if query_dict["resourcename"] is None:
+        raise ValueError("resource has no resourceName")
+    return {name: value for name, value in query_dict.items() if value is not None}
+
+
+def build_queries(row, kinds=QUERY_KINDS):
+    """(kind, query) pairs for one resource, phrased by the lambda's own lambda/function/queries.py: the combined
+    "also known as" query the agent's action group sends, and one query per name, synonym and RRID as its fan-out sends."""
+    query_dict = resource_parameters(row)
+    resourcetype = query_dict.get("resourcetype")
+    queries = []
+    if "combined" in kinds:
+        queries.append(("combined", build_query(query_dict)))
+    if "name" in kinds:
+        queries.extend(("name", q) for q in name_queries([query_dict["resourcename"]], resourcetype))
+    if "synonym" in kinds:
+        queries.extend(("synonym", q) for q in name_queries(split_names(None, query_dict.get("synonyms")), resourcetype))
+    if "rrid" in kinds:
+        queries.extend(("rrid", q) for q in name_queries([], rrid=query_dict.get("rrid")))
+    # drop repeats, keeping the first kind that asked
+    seen = set()
+    return [(kind, query) for kind, query in queries if not (query in seen or seen.add(query))]
+
+
+class SnapshotWriter(PartFileWriter):
+    """Writes snapshot rows as retrievals-<run>-<part>.parquet part files (see sinks.PartFileWriter)."""
+
+    def __init__(self, output_dir, on_written=None, batch_rows=5000):
+        pa, _ = import_pyarrow("Retrieval snapshots")
+        schema = pa.schema([(column, getattr(pa, kind)()) for column, kind in SNAPSHOT_SCHEMA])
+        super().__init__(output_dir, schema, "retrievals", on_written=on_written, batch_rows=batch_rows)
+
+    def write(self, resourceId, rows):
+        self.append(resourceId, {column: [row[column] for row in rows] for column, _ in SNAPSHOT_SCHEMA})
+
+
+def snapshot_rows(row, kind, query, results):
+    return [
+        {
+            "resourceId": row["resourceId"],
+            "resourceName": _cell(row.get("resourceName")),
+            "synonyms": ", ".join(split_names(None, row.get("synonyms"))) or None,
+            "queryKind": kind,
+            "query": query,
+            "rank": rank,
+            "score": result.score,
+            "text": result.text,
+            "uri": result.uri,
+            "doi": result.doi,
+            "metadata": json.dumps(result.metadata, separators=(",", ":")),
+        }
+        for rank, result in enumerate(results, start=1)
+    ]
+
+
+def retrieve_resource(row, client, config, limits, kinds=QUERY_KINDS):
+    rows = []
+    for kind, query in build_queries(row, kinds):
+        request = build_request(query, config)
+        response = call_with_retry(lambda: client.retrieve(**request), *limits)
+        rows.extend(snapshot_rows(row, kind, query, retrieval_results(response)))
+    return rows
+
+
+def run_snapshot(tools, writer, ledger, client, config, limits, kinds=QUERY_KINDS, max_workers=8):
+    rows = [row for row in tools.to_dict("records") if not ledger.is_done(row["resourceId"])]
+    logger.info(f"{len(tools) - len(rows)} resources already in the snapshot, {len(rows)} to retrieve")
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {executor.submit(retrieve_resource, row, client, config, limits, kinds): row["resourceId"] for row in rows}
+        for future in as_completed(futures):
+            resourceId = futures[future]
+            try:
+                writer.write(resourceId, future.result())
+            except Exception as e:
+                logger.error(f"Retrieval failed for resourceId {resourceId}: {e}")
+                ledger.record(resourceId, FAILED, error=str(e))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Save knowledge base search results for the whole tools table")
+    parser.add_argument("--output", required=True, help="snapshot directory")
+    parser.add_argument("--tools", help="CSV export of the tools table (default: NFTC_TOOLS_CSV, then Synapse)")
+    parser.add_argument("--queries", default=",".join(QUERY_KINDS), help="query kinds to run (default: %(default)s)")
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("NFTC_MAX_CONCURRENCY", "8")))
+    parser.add_argument("--rate", type=float, default=float(os.environ.get("NFTC_REQUESTS_PER_SECOND", "5")),
+                        help="retrieve calls per second")
+    parser.add_argument("--retry-budget", type=int, default=int(os.environ.get("NFTC_RETRY_BUDGET", "200")))
+    parser.add_argument("--limit", type=int, help="only the first N resources")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    kinds = tuple(k.strip() for k in args.queries.split(",") if k.strip())
+    unknown = set(kinds) - set(QUERY_KINDS)
+    if unknown:
+        parser.error(f"unknown query kinds {sorted(unknown)}, expected some of {', '.join(QUERY_KINDS)}")
+
+    tools = load_tools_table(args.tools)
+    if args.limit:
+        tools = tools.head(args.limit)
+
+    config = BedrockConfig.from_environment(max_pool_connections=max(args.workers, 10))
+    if config.local_index:
+        client = get_client(config)
+    else:
+        # botocore's own retries are turned off so that throttling reaches the shared limiter
+        client = make_client(config, retries={'total_max_attempts': 1})
+    limits = (TokenBucket(rate=args.rate, capacity=args.workers), AdaptiveConcurrency(maximum=args.workers), RetryBudget(args.retry_budget))
+
+    ledger = RunLedger(os.path.join(args.output, "_ledger.jsonl"))
+    writer = SnapshotWriter(
+        args.output,
+        on_written=lambda resourceId, output: ledger.record(resourceId, DONE, output=output),
+    )
+    try:
+        run_snapshot(tools, writer, ledger, client, config, limits, kinds=kinds, max_workers=args.workers)
+    finally:
+        writer.close()
+    print(ledger.summary())
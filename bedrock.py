@@ -1,134 +1,206 @@
-import boto3
-import pprint
-from botocore.client import Config
-import re
-
-region_name = "us-east-1"
-pp = pprint.PrettyPrinter(indent=2)
-
-# Connect to AWS Bedrock
-session = boto3.Session(
-aws_access_key_id='abc',
-aws_secret_access_key='xyz',
-aws_session_token='123'
-)
+## knowledge base retrieve and retrieveAndGenerate, shared by agent.py and the batch scripts
+##
+##   python bedrock.py "Tell me about HCT 116 Cell Line also known as RRID:CVCL_0291"
+##   python bedrock.py --retrieve "Tell me about MPNST-SP-001, a Animal Model"
 
-# Connect to AWS Bedrock
-
-model_id = 'anthropic.claude-3-sonnet-20240229-v1:0'
-region_id = region_name 
-
-bedrock_agent_client = session.client("bedrock-agent-runtime", region_name=region_name)
+import argparse
+import os
+import pprint
+import threading
+from dataclasses import dataclass, field
 
-kbId = 'ZMHF67DY2R'
+import boto3
+from botocore.client import Config
 
+_SOURCE_URI_KEY = "x-amz-bedrock-kb-source-uri"
+
+
+@dataclass(frozen=True)
+class BedrockConfig:
+    """Which knowledge base and model to use, and how to search it. from_environment reads the NFTC_* overrides."""
+
+    knowledge_base_id: str = 'ZMHF67DY2R'
+    model_id: str = 'anthropic.claude-3-sonnet-20240229-v1:0'
+    region: str = "us-east-1"
+    number_of_results: int = 50
+    # HYBRID or SEMANTIC; None leaves the choice to Bedrock
+    search_type: str = None
+    max_tokens: int = 4096
+    #please note that these temperature and topP values are somewhat arbitrary and may need to be adjusted
+    temperature: float = 0.2
+    top_p: float = 0.9
+    # a local stand-in such as fake_bedrock.py instead of AWS
+    endpoint_url: str = None
+    max_pool_connections: int = 10
+    # a local_index.py index file to search instead of the knowledge base (retrieve only)
+    local_index: str = None
+
+    @property
+    def model_arn(self):
+        return f'arn:aws:bedrock:{self.region}::foundation-model/{self.model_id}'
+
+    @classmethod
+    def from_environment(cls, **overrides):
+        env = {
+            "knowledge_base_id": os.environ.get("NFTC_KB_ID"),
+            "model_id": os.environ.get("NFTC_MODEL_ID"),
+            "region": os.environ.get("NFTC_REGION"),
+            "number_of_results": os.environ.get("NFTC_NUMBER_OF_RESULTS"),
+            "search_type": os.environ.get("NFTC_SEARCH_TYPE"),
+            "endpoint_url": os.environ.get("NFTC_BEDROCK_ENDPOINT_URL"),
+            "local_index": os.environ.get("NFTC_LOCAL_INDEX"),
+        }
+        if env["number_of_results"] is not None:
+            env["number_of_results"] = int(env["number_of_results"])
+        return cls(**{**{k: v for k, v in env.items() if v is not None}, **overrides})
+
+
+@dataclass(slots=True)
+class RetrievalResult:
+    """One knowledge base chunk. score is None for the references cited by retrieveAndGenerate."""
+
+    text: str
+    score: float = None
+    uri: str = None
+    doi: str = None
+    metadata: dict = field(default_factory=dict)
+
+    @classmethod
+    def from_response(cls, result):
+        # the same shape in retrieve's retrievalResults and retrieveAndGenerate's retrievedReferences
+        metadata = result.get("metadata") or {}
+        uri = ((result.get("location") or {}).get("s3Location") or {}).get("uri") or metadata.get(_SOURCE_URI_KEY)
+        doi = metadata.get("doi")
+        # the metadata sidecars store the DOI as a one-element list
+        if isinstance(doi, list):
+            doi = doi[0] if doi else None
+        return cls(
+            text=(result.get("content") or {}).get("text", ""),
+            score=result.get("score"),
+            uri=uri,
+            doi=doi,
+            metadata=metadata,
+        )
 
 
-def retrieveAndGenerate(input, kbId, model_id, sessionId=None, region_id="us-east-1", temp = 0.2, top_p = 0.9):
-    model_arn = f'arn:aws:bedrock:{region_id}::foundation-model/{model_id}'
-    if sessionId:
-        return bedrock_agent_client.retrieve_and_generate(
-            input={
-                'text': input
-            },
-            retrieveAndGenerateConfiguration={
-                'type': 'KNOWLEDGE_BASE',
-                'knowledgeBaseConfiguration': {
-                    'knowledgeBaseId': kbId,
-                    'modelArn': model_arn,
-                    'generationConfiguration': {
-                        'retrievalConfiguration': {
-                            'vectorSearchConfiguration': {
-                                'numberOfResults': 50
-                            }
+@dataclass(slots=True)
+class Generation:
+    text: str
+    session_id: str
+    references: list
+
+
+def retrieval_configuration(config):
+    search = {'numberOfResults': config.number_of_results}
+    if config.search_type:
+        search['overrideSearchType'] = config.search_type
+    return {'vectorSearchConfiguration': search}
+
+
+def build_request(input, config, generate=False, sessionId=None):
+    """Keyword arguments for client.retrieve, or with generate for client.retrieve_and_generate."""
+    if not generate:
+        return {
+            'knowledgeBaseId': config.knowledge_base_id,
+            'retrievalQuery': {'text': input},
+            'retrievalConfiguration': retrieval_configuration(config),
+        }
+    request = {
+        'input': {'text': input},
+        'retrieveAndGenerateConfiguration': {
+            'type': 'KNOWLEDGE_BASE',
+            'knowledgeBaseConfiguration': {
+                'knowledgeBaseId': config.knowledge_base_id,
+                'modelArn': config.model_arn,
+                'generationConfiguration': {
+                    'inferenceConfig': {
+                        'textInferenceConfig': {
+                            'maxTokens': config.max_tokens,
+                            'temperature': config.temperature,
+                            'topP': config.top_p
                         }
                     }
-                }
-            },
-            sessionId=sessionId
-        )
-    else:
-        return bedrock_agent_client.retrieve_and_generate(
-            input={
-                'text': input
-            },
-            retrieveAndGenerateConfiguration={
-                'type': 'KNOWLEDGE_BASE',
-                'knowledgeBaseConfiguration': {
-                    'knowledgeBaseId': kbId,
-                    'modelArn': model_arn,
-                    'generationConfiguration': {
-                        'inferenceConfig': {
-                            'textInferenceConfig': {
-                                'maxTokens': 4096,
-                                #please note that these temperature and topP values are somewhat arbitrary and may need to be adjusted
-                                'temperature': temp,
-                                'topP': top_p
-                            }
-                        }
-                    },
-                    'retrievalConfiguration': {
-                        'vectorSearchConfiguration': {
-                             'numberOfResults': 50
-                            }
-                        }
-                    }
-
-                }
-
-        )
-
-
-
-# response = retrieveAndGenerate("Tell me about MPNST-SP-001, a Animal Model, resource ID 41c369b5-25f3-4285-829f-5481b41b230e.",
-#                                kbId, 
-#                                model_id)
-
-
-
-def retrieve(input, kbId):
-        return bedrock_agent_client.retrieve(
-              knowledgeBaseId = kbId,
-              retrievalQuery={
-                'text': input
                 },
-                retrievalConfiguration={
-                      'vectorSearchConfiguration': {
-                            'numberOfResults': 50
-                            }
-                        }
-                        )
-
-
-# response = retrieve('Tell me about "B6;129S2-Trp53tm1Tyj Nf1tm1Tyj/J", a Animal Model',
-#                                                    kbId)
-
-response_2 = retrieveAndGenerate("Tell me about HCT 116 Cell Line also known as RRID:CVCL_0291",
-                              kbId, 
-                                model_id)
-
-# result_text = str(response.get('retrievalResults'))
-# #truncate response to under 25 kb
-# if len(result_text) > 25000:
-#       result_text = result_text[:25000] + "..."
-# print(result_text)
-
-# #extract scores from result_text 
-# def extract_scores(result_text):
-#     scores = re.findall(r"'score': (\d+\.\d+)", result_text)
-#     return scores
-
-# scores = extract_scores(result_text)
-# print(scores)
-
-#repeat for response_2
-result_text_2 = response_2.get("citations")
-
-retrieved_references = result_text_2[0]['retrievedReferences']
-# #truncate response_2 to under 25 kb
-# if len(result_text_2) > 25000:
-#     result_text_2 = result_text_2[:25000] + "..."
-print(retrieved_references)
-# #extract scores from result_text_2
-# scores_2 = extract_scores(result_text_2)
-# print(scores_2)
\ No newline at end of file
+                # a sibling of generationConfiguration, not part of it
+                'retrievalConfiguration': retrieval_configuration(config),
+            }
+        }
+    }
+    if sessionId:
+        request['sessionId'] = sessionId
+    return request
+
+
+def make_client(config, session=None, **client_config):
+    """A new bedrock-agent-runtime client; client_config overrides the botocore Config, e.g. retries."""
+    session = session or boto3.Session()
+    return session.client(
+        "bedrock-agent-runtime",
+        region_name=config.region,
+        endpoint_url=config.endpoint_url,
+        config=Config(max_pool_connections=config.max_pool_connections, tcp_keepalive=True, **client_config),
+    )
+
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+def get_client(config):
+    # boto3 clients are thread-safe, so one client (and its connection pool) per region and endpoint is shared
+    key = (config.region, config.endpoint_url, config.max_pool_connections, config.local_index)
+    with _clients_lock:
+        if key not in _clients:
+            if config.local_index:
+                from local_index import LocalIndex, LocalRetrieveClient
+
+                _clients[key] = LocalRetrieveClient(LocalIndex.load(config.local_index))
+            else:
+                _clients[key] = make_client(config)
+        return _clients[key]
+
+
+def retrieval_results(response):
+    """The RetrievalResults of a retrieve response, best score first; the API does not promise an order."""
+    results = [RetrievalResult.from_response(r) for r in response.get('retrievalResults', [])]
+    # sorted is stable, so equal scores keep the response's order
+    return sorted(results, key=lambda r: r.score if r.score is not None else float('-inf'), reverse=True)
+
+
+def retrieve(input, config=None, client=None):
+    """Searches the knowledge base; returns RetrievalResults, best score first."""
+    config = config or BedrockConfig.from_environment()
+    client = client or get_client(config)
+    return retrieval_results(client.retrieve(**build_request(input, config)))
+
+
+def retrieveAndGenerate(input, config=None, sessionId=None, client=None):
+    """Searches the knowledge base and answers with the model; pass the returned session_id to continue the session."""
+    config = config or BedrockConfig.from_environment()
+    if config.local_index and client is None:
+        raise ValueError("retrieveAndGenerate needs the Bedrock knowledge base; the local index (NFTC_LOCAL_INDEX) only answers retrieve")
+    client = client or get_client(config)
+    response = client.retrieve_and_generate(**build_request(input, config, generate=True, sessionId=sessionId))
+    references = [
+        RetrievalResult.from_response(reference)
+        for citation in response.get('citations', [])
+        for reference in citation.get('retrievedReferences', [])
+    ]
+    return Generation(text=(response.get('output') or {}).get('text', ''), session_id=response.get('sessionId'), references=references)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the knowledge base")
+    parser.add_argument("query", nargs="?", default="Tell me about HCT 116 Cell Line also known as RRID:CVCL_0291")
+    parser.add_argument("--retrieve", action="store_true", help="only search, without generating an answer")
+    args = parser.parse_args()
+
+    pp = pprint.PrettyPrinter(indent=2)
+    config = BedrockConfig.from_environment()
+    if args.retrieve:
+        results = retrieve(args.query, config)
+        pp.pprint([(r.score, r.doi, r.text[:100]) for r in results])
+    else:
+        response = retrieveAndGenerate(args.query, config)
+        print(response.text)
+        pp.pprint(response.references)
@@ -0,0 +1,64 @@
+## detects when follow-up turns stop producing new observations, so a session can end early
+
+import re
+
+_DOI_PREFIX = re.compile(r"^(https?://)?(www\.|dx\.)?doi\.org/", re.IGNORECASE)
+_NON_WORD = re.compile(r"[^a-z0-9]+")
+
+
+def normalize_text(text):
+    return _NON_WORD.sub(" ", str(text).lower()).strip()
+
+
+def normalize_doi(doi):
+    # the agent returns the same DOI as https://doi.org/..., https://www.doi.org/... or bare, sometimes as a list
+    if isinstance(doi, list):
+        doi = doi[0] if doi else ""
+    return _DOI_PREFIX.sub("", str(doi or "").strip()).lower()
+
+
+class ConvergenceDetector:
+    """Tracks how many observations in each turn are new versus repeats of earlier turns.
+
+    An observation repeats an earlier one when it cites the same DOI and its normalized text is
+    identical, or shares at least `similarity` of its words (Jaccard) with it. Once the share of
+    new observations stays below `min_yield` for `patience` turns in a row, `converged` is True.
+    """
+
+    def __init__(self, min_yield=0.25, patience=1, similarity=0.8):
+        self.min_yield = min_yield
+        self.patience = patience
+        self.similarity = similarity
+        self.yields = []
+        self._seen = {}
+        self._low_turns = 0
+
+    def _is_repeat(self, doi, text):
+        words = set(text.split())
+        for seen_text, seen_words in self._seen.get(doi, []):
+            if text == seen_text:
+                return True
+            union = words | seen_words
+            if union and len(words & seen_words) / len(union) >= self.similarity:
+                return True
+        return False
+
+    def update(self, observations):
+        """Records one turn's observations (a list of Observation records) and returns how many of them were new."""
+        new = 0
+        for observation in observations:
+            doi = normalize_doi(observation.doi)
+            text = normalize_text(observation.observationText or "")
+            if self._is_repeat(doi, text):
+                continue
+            self._seen.setdefault(doi, []).append((text, set(text.split())))
+            new += 1
+
+        turn_yield = new / len(observations) if observations else 0.0
+        self.yields.append(turn_yield)
+        self._low_turns = self._low_turns + 1 if turn_yield < self.min_yield else 0
+        return new
+
+    @property
+    def converged(self):
+        return self._low_turns >= self.patience
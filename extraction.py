@@ -0,0 +1,126 @@
+## pulls the <json_response> block out of an agent reply and recovers as many observation objects from it as possible
+
+import json
+import re
+from dataclasses import dataclass
+
+OPEN_TAG = "<json_response>"
+CLOSE_TAG = "</json_response>"
+
+
+@dataclass
+class ObjectError:
+    """An object in the JSON array that could not be parsed, even after repair."""
+
+    index: int
+    text: str
+    message: str
+
+
+def extract_json_response(text):
+    """Returns the text between the <json_response> tags, or None when the reply has no opening tag.
+
+    A missing closing tag (a reply cut off mid-stream) returns everything after the opening tag.
+    """
+    start = text.find(OPEN_TAG)
+    if start == -1:
+        return None
+    start += len(OPEN_TAG)
+    end = text.find(CLOSE_TAG, start)
+    return text[start:] if end == -1 else text[start:end]
+
+
+def _split_objects(block):
+    # yield the text of each top-level {...} in the block, tracking strings so braces inside them don't count;
+    # an object still open at the end of the block (a truncated reply) is yielded as is
+    depth = 0
+    start = None
+    in_string = False
+    escaped = False
+    for i, c in enumerate(block):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+        elif c == '"':
+            in_string = True
+        elif c == "{":
+            if depth == 0:
+                start = i
+            depth += 1
+        elif c == "}" and depth > 0:
+            depth -= 1
+            if depth == 0:
+                yield block[start:i + 1]
+                start = None
+    if start is not None:
+        yield block[start:]
+
+
+_AFTER_COLON = re.compile(r"\s*[,}]")
+_AFTER_COMMA = re.compile(r"\s*[}\]]")
+
+
+def repair(text):
+    """Fixes the malformed JSON the agent is known to produce, outside of string values.
+
+    Empty values ("observationTime":,) become null, and trailing commas before } or ] are dropped.
+    """
+    out = []
+    in_string = False
+    escaped = False
+    for i, c in enumerate(text):
+        if in_string:
+            if escaped:
+                escaped = False
+            elif c == "\\":
+                escaped = True
+            elif c == '"':
+                in_string = False
+            out.append(c)
+            continue
+        if c == '"':
+            in_string = True
+        elif c == ":" and _AFTER_COLON.match(text, i + 1):
+            out.append(": null")
+            continue
+        elif c == "," and _AFTER_COMMA.match(text, i + 1):
+            continue
+        out.append(c)
+    return "".join(out)
+
+
+def parse_observations(block):
+    """Parses a <json_response> block into (objects, errors).
+
+    A well-formed array is parsed in one go. Otherwise each top-level object is parsed on its own,
+    repaired if needed, so one bad element only loses that element. null entries ([null]) are skipped.
+    """
+    block = block.strip()
+    try:
+        parsed = json.loads(block)
+    except json.JSONDecodeError:
+        pass
+    else:
+        if isinstance(parsed, dict):
+            parsed = [parsed]
+        if isinstance(parsed, list):
+            return [item for item in parsed if isinstance(item, dict)], []
+        return [], []
+
+    objects = []
+    errors = []
+    for index, text in enumerate(_split_objects(block)):
+        try:
+            objects.append(json.loads(text))
+            continue
+        except json.JSONDecodeError:
+            pass
+        try:
+            objects.append(json.loads(repair(text)))
+        except json.JSONDecodeError as e:
+            errors.append(ObjectError(index, text, str(e)))
+    return objects, errors
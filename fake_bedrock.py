@@ -0,0 +1,299 @@
+## a local stand-in for bedrock-agent-runtime, for running agent.py, bedrock.py and the lambda without AWS
+##
+## It speaks enough of the REST/event-stream protocol for boto3's invoke_agent, retrieve and retrieve_and_generate,
+## and replays the observations saved in data/nftc_observations. Point a client at it with endpoint_url, e.g.
+##
+##   python fake_bedrock.py --port 8777 --latency 0.5 --throttle-rate 0.1 --write-tools-csv /tmp/tools.csv
+##   NFTC_BEDROCK_ENDPOINT_URL=http://localhost:8777 NFTC_TOOLS_CSV=/tmp/tools.csv python agent.py
+
+import argparse
+import ast
+import base64
+import csv
+import glob
+import json
+import os
+import random
+import re
+import struct
+import threading
+import time
+import uuid
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+OBSERVATION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "nftc_observations")
+
+_INVOKE_AGENT = re.compile(r"^/agents/[^/]+/agentAliases/[^/]+/sessions/([^/]+)/text$")
+_RETRIEVE = re.compile(r"^/knowledgebases/[^/]+/retrieve$")
+_RESOURCE_ID = re.compile(r"resourceId: ([0-9a-f-]{36})")
+
+
+def _header(name, value):
+    # event-stream headers used here are all strings (type 7)
+    name = name.encode("utf-8")
+    value = value.encode("utf-8")
+    return struct.pack("!B", len(name)) + name + struct.pack("!BH", 7, len(value)) + value
+
+
+def encode_event(headers, payload):
+    """Encodes one application/vnd.amazon.eventstream message."""
+    headers = b"".join(_header(name, value) for name, value in headers.items())
+    total = 12 + len(headers) + len(payload) + 4
+    prelude = struct.pack("!II", total, len(headers))
+    prelude += struct.pack("!I", zlib.crc32(prelude))
+    message = prelude + headers + payload
+    return message + struct.pack("!I", zlib.crc32(message))
+
+
+def chunk_event(data):
+    payload = json.dumps({"bytes": base64.b64encode(data).decode("ascii")}).encode("utf-8")
+    return encode_event({":event-type": "chunk", ":content-type": "application/json", ":message-type": "event"}, payload)
+
+
+def exception_event(error_type, message):
+    payload = json.dumps({"message": message}).encode("utf-8")
+    return encode_event({":exception-type": error_type, ":content-type": "application/json", ":message-type": "exception"}, payload)
+
+
+def _cell(column, value):
+    # turn the CSV text back into what the agent originally returned
+    if value in ("", "NA"):
+        return "" if column != "observationTime" else None
+    if column in ("resourceType", "observationType") and value.startswith("["):
+        return ast.literal_eval(value)
+    if column == "observationTime":
+        try:
+            return float(value) if "." in value else int(value)
+        except ValueError:
+            return value
+    return value
+
+
+def load_observations(directory=OBSERVATION_DIR):
+    """Loads every observation_<resourceId>.csv into {resourceId: [observation dicts]}."""
+    observations = {}
+    for path in glob.glob(os.path.join(directory, "observation_*.csv")):
+        resourceId = os.path.basename(path)[len("observation_"):-len(".csv")]
+        with open(path, newline="") as f:
+            rows = [row for row in csv.DictReader(f) if row.get("observationText")]
+        observations[resourceId] = [{column: _cell(column, value) for column, value in row.items()} for row in rows]
+    return observations
+
+
+def _s3_uri(doi):
+    return "s3://nf-tools-database-publications/nftc_pdfs/nftc_{}.pdf".format(re.sub(r"^https?://(www\.)?doi\.org/", "", doi).replace("/", "_"))
+
+
+class FakeBedrock:
+    """Canned responses plus latency, throttling and error injection, shared by all request threads."""
+
+    def __init__(self, observations, latency=0.0, chunk_delay=0.0, chunk_size=64, per_turn=3,
+                 throttle_rate=0.0, stream_throttle_rate=0.0, error_rate=0.0, seed=None):
+        self.observations = observations
+        self.latency = latency
+        self.chunk_delay = chunk_delay
+        self.chunk_size = chunk_size
+        self.per_turn = per_turn
+        self.throttle_rate = throttle_rate
+        self.stream_throttle_rate = stream_throttle_rate
+        self.error_rate = error_rate
+        self.random = random.Random(seed)
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.counts = {"invoke_agent": 0, "retrieve": 0, "retrieve_and_generate": 0, "throttled": 0, "errors": 0}
+        self.passages = [
+            (resourceId, o["resourceName"], o["observationText"], o["doi"])
+            for resourceId, rows in observations.items() for o in rows
+        ]
+
+    def roll(self, rate):
+        with self.lock:
+            return self.random.random() < rate
+
+    def count(self, key):
+        with self.lock:
+            self.counts[key] += 1
+
+    def next_turn(self, sessionId, inputText):
+        # the first prompt names the resourceId; later turns in the same session page through its observations
+        with self.lock:
+            session = self.sessions.get(sessionId)
+            if session is None:
+                match = _RESOURCE_ID.search(inputText)
+                session = self.sessions[sessionId] = {"resourceId": match.group(1) if match else None, "turn": 0}
+            turn = session["turn"]
+        rows = self.observations.get(session["resourceId"], [])
+        page = rows[turn * self.per_turn:(turn + 1) * self.per_turn]
+        body = json.dumps(page) if page else "[null]"
+        return "Here are the observations I found.\n<json_response>{}</json_response>".format(body)
+
+    def turn_sent(self, sessionId):
+        # only a turn streamed whole moves the session to the next page, so a retried turn gets the same page
+        with self.lock:
+            self.sessions[sessionId]["turn"] += 1
+
+    def search(self, text, k):
+        # passages about resources named in the query score highest, then random filler up to k results
+        text = text.lower()
+        hits = [p for p in self.passages if p[1] and p[1].lower() in text]
+        with self.lock:
+            filler = self.random.sample(self.passages, min(len(self.passages), max(0, k - len(hits))))
+        results = []
+        for rank, (resourceId, name, passage, doi) in enumerate((hits + filler)[:k]):
+            uri = _s3_uri(doi)
+            results.append({
+                "content": {"text": passage},
+                "location": {"type": "S3", "s3Location": {"uri": uri}},
+                "metadata": {"x-amz-bedrock-kb-source-uri": uri, "doi": [doi]},
+                "score": round(0.9 * 0.98 ** rank, 6),
+            })
+        return results
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    fake = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status, body, headers=None):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _send_error(self, status, error_type, message):
+        self._send_json(status, {"message": message}, {"x-amzn-ErrorType": error_type})
+
+    def do_POST(self):
+        fake = self.fake
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)) or 0)
+        request = json.loads(body) if body else {}
+        path = self.path.split("?")[0]
+
+        if fake.latency:
+            time.sleep(fake.latency)
+        if fake.roll(fake.throttle_rate):
+            fake.count("throttled")
+            return self._send_error(429, "ThrottlingException", "Rate exceeded")
+        if fake.roll(fake.error_rate):
+            fake.count("errors")
+            return self._send_error(500, "InternalServerException", "Injected internal error")
+
+        match = _INVOKE_AGENT.match(path)
+        if match:
+            fake.count("invoke_agent")
+            return self._invoke_agent(match.group(1), request)
+        if _RETRIEVE.match(path):
+            fake.count("retrieve")
+            k = request.get("retrievalConfiguration", {}).get("vectorSearchConfiguration", {}).get("numberOfResults", 5)
+            return self._send_json(200, {"retrievalResults": fake.search(request["retrievalQuery"]["text"], k)})
+        if path == "/retrieveAndGenerate":
+            fake.count("retrieve_and_generate")
+            return self._retrieve_and_generate(request)
+        self._send_error(404, "ResourceNotFoundException", "Unknown operation {}".format(path))
+
+    def _invoke_agent(self, sessionId, request):
+        fake = self.fake
+        text = fake.next_turn(sessionId, request.get("inputText", "")).encode("utf-8")
+        events = [chunk_event(text[i:i + fake.chunk_size]) for i in range(0, len(text), fake.chunk_size)]
+        throttled = fake.roll(fake.stream_throttle_rate)
+        if throttled:
+            # throttling can also arrive part way through the stream
+            fake.count("throttled")
+            events = events[:len(events) // 2] + [exception_event("throttlingException", "Rate exceeded")]
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/vnd.amazon.eventstream")
+        self.send_header("x-amzn-bedrock-agent-content-type", "application/json")
+        self.send_header("x-amz-bedrock-agent-session-id", sessionId)
+        self.send_header("Content-Length", str(sum(len(e) for e in events)))
+        self.end_headers()
+        for event in events:
+            self.wfile.write(event)
+            self.wfile.flush()
+            if fake.chunk_delay:
+                time.sleep(fake.chunk_delay)
+        if not throttled:
+            fake.turn_sent(sessionId)
+
+    def _retrieve_and_generate(self, request):
+        text = request["input"]["text"]
+        config = request.get("retrieveAndGenerateConfiguration", {}).get("knowledgeBaseConfiguration", {})
+        k = config.get("retrievalConfiguration", {}).get("vectorSearchConfiguration", {}).get("numberOfResults", 5)
+        results = self.fake.search(text, k)
+        answer = " ".join(r["content"]["text"] for r in results[:3])
+        self._send_json(200, {
+            "sessionId": request.get("sessionId") or str(uuid.uuid4()),
+            "output": {"text": answer},
+            "citations": [{
+                "generatedResponsePart": {"textResponsePart": {"text": answer, "span": {"start": 0, "end": len(answer)}}},
+                "retrievedReferences": [{k: v for k, v in r.items() if k != "score"} for r in results[:3]],
+            }],
+        })
+
+
+def write_tools_csv(observations, path):
+    # a stand-in for the Synapse tools table covering every resource with canned observations
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=["resourceId", "resourceName", "resourceType", "rrid", "synonyms"])
+        writer.writeheader()
+        for resourceId, rows in observations.items():
+            first = rows[0] if rows else {}
+            resourceType = first.get("resourceType") or ["Cell Line"]
+            writer.writerow({
+                "resourceId": resourceId,
+                "resourceName": first.get("resourceName", resourceId),
+                "resourceType": resourceType[0] if isinstance(resourceType, list) else resourceType,
+                "rrid": "",
+                "synonyms": "",
+            })
+
+
+def serve(fake, host="127.0.0.1", port=8777):
+    handler = type("FakeBedrockHandler", (Handler,), {"fake": fake})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the bedrock-agent-runtime API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8777)
+    parser.add_argument("--observations", default=OBSERVATION_DIR, help="directory of observation_<resourceId>.csv files to replay")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds before every response")
+    parser.add_argument("--chunk-delay", type=float, default=0.0, help="seconds between invoke_agent chunk events")
+    parser.add_argument("--chunk-size", type=int, default=64, help="bytes of completion text per chunk event")
+    parser.add_argument("--per-turn", type=int, default=3, help="observations returned per agent turn")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="share of requests rejected with ThrottlingException")
+    parser.add_argument("--stream-throttle-rate", type=float, default=0.0, help="share of invoke_agent streams cut off by a throttlingException event")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="share of requests failing with InternalServerException")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--write-tools-csv", default=None, help="also write a tools table CSV covering the canned resources")
+    args = parser.parse_args()
+
+    observations = load_observations(args.observations)
+    if args.write_tools_csv:
+        write_tools_csv(observations, args.write_tools_csv)
+
+    fake = FakeBedrock(
+        observations, latency=args.latency, chunk_delay=args.chunk_delay, chunk_size=args.chunk_size,
+        per_turn=args.per_turn, throttle_rate=args.throttle_rate, stream_throttle_rate=args.stream_throttle_rate,
+        error_rate=args.error_rate, seed=args.seed,
+    )
+    server = serve(fake, args.host, args.port)
+    print(f"fake bedrock-agent-runtime listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(fake.counts)
@@ -3,3 +3,10 @@ set -eo pipefail
 rm -rf package
 cd function
 pip3 install --target ../package/python -r requirements.txt
+cd ..
+# ./2-build-layer.sh --slim keeps only the botocore service models the function uses and precompiles the layer
+if [[ "$1" == "--slim" ]]; then
+    python3 slim_layer.py package/python
+else
+    python3 slim_layer.py package/python --report-only
+fi
@@ -1,5 +1,6 @@
 #!/bin/bash
 set -eo pipefail
 ARTIFACT_BUCKET=$(cat bucket-name.txt)
+# the batch function writes prefetched retrievals to $RESULTS_BUCKET, or to the artifact bucket if unset
 aws cloudformation package --template-file template.yml --s3-bucket $ARTIFACT_BUCKET --output-template-file out.yml
-aws cloudformation deploy --template-file out.yml --stack-name observation-extractions --capabilities CAPABILITY_NAMED_IAM
+aws cloudformation deploy --template-file out.yml --stack-name observation-extractions --capabilities CAPABILITY_NAMED_IAM --parameter-overrides ResultsBucket=${RESULTS_BUCKET:-$ARTIFACT_BUCKET}
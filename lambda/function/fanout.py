@@ -0,0 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor, wait
+
+from logs import get_logger
+
+logger = get_logger("fanout")
+
+
+def chunk_key(result):
+    # the same chunk found by two queries has the same source location and text
+    location = result.get("location") or {}
+    uri = (location.get("s3Location") or {}).get("uri")
+    return uri, (result.get("content") or {}).get("text")
+
+
+def reciprocal_rank_fusion(result_lists, k=60):
+    """Merges ranked result lists, scoring each distinct chunk by the sum of 1 / (k + rank) over the lists.
+
+    The returned results are best fused score first, with "score" replaced by the fused score.
+    """
+    fused = {}
+    for results in result_lists:
+        ranked = sorted(results, key=lambda r: r.get("score") or 0, reverse=True)
+        for rank, result in enumerate(ranked, start=1):
+            key = chunk_key(result)
+            if key not in fused:
+                fused[key] = [0.0, result]
+            fused[key][0] += 1.0 / (k + rank)
+    merged = sorted(fused.values(), key=lambda entry: entry[0], reverse=True)
+    return [dict(result, score=round(score, 6)) for score, result in merged]
+
+
+class FanOut:
+    """Runs one retrieval per query on a thread pool that lives as long as the container."""
+
+    def __init__(self, retrieve, max_workers=8):
+        self.retrieve = retrieve
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def search(self, queries, timeout=None):
+        """Returns (fused results, number of queries that failed or did not finish within timeout seconds)."""
+        futures = [self._executor.submit(self.retrieve, query) for query in queries]
+        done, not_done = wait(futures, timeout=timeout)
+        result_lists = []
+        failed = len(not_done)
+        for future in futures:
+            if future not in done:
+                continue
+            try:
+                result_lists.append(future.result())
+            except Exception as e:
+                logger.warning("Retrieval failed: %s", e)
+                failed += 1
+        return reciprocal_rank_fusion(result_lists), failed
@@ -1,98 +1,179 @@
 import json
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+
 import boto3
+from botocore.config import Config
 
+import results_store as results
+import retrieval_cache as cache
+from logs import get_logger, log_payload
+from retrieval_cache import cache_key
+from fanout import FanOut
+from queries import build_query, name_queries
+from relevance import filter_results, split_names
+from serialize import pack_results
+from tracing import Tracer
 
-def lambda_handler(event, context):
-    agent = event['agent']
-    actionGroup = event['actionGroup']
-    function = event['function']
-    query = event.get('parameters', [])
-    
-    query_dict = {param['name'].lower(): str(param['value']) for param in query}
-    
-    input = "Tell me about {}".format(query_dict['resourcename'])
-    if 'resourcetype' in query_dict:
-        input += " {}".format(query_dict['resourcetype'])
-    if 'synonyms' in query_dict:
-        input += " also known as {}".format(query_dict['synonyms'])
-    if 'rrid' in query_dict:
-        input += " also known as RRID:{}".format(query_dict['rrid'])
-
-    print(input)
-    
-    region_name = "us-east-1"
+# configuration comes from the function's environment (see template.yml)
+REGION = os.environ.get("BEDROCK_REGION", os.environ.get("AWS_REGION", "us-east-1"))
+MODEL_ID = os.environ.get("MODEL_ID", "anthropic.claude-3-sonnet-20240229-v1:0")
+KB_ID = os.environ.get("KB_ID", "ZMHF67DY2R")
+# byte budget for the search results returned to the agent
+MAX_RESULT_BYTES = int(os.environ.get("MAX_RESULT_BYTES", "20000"))
+# what to do with chunks that never mention the resource: drop, rank (move last) or off
+RELEVANCE_FILTER = os.environ.get("RELEVANCE_FILTER", "drop")
+# RETRIEVAL_FANOUT=1 runs one search per name variant in parallel instead of one combined query
+RETRIEVAL_FANOUT = os.environ.get("RETRIEVAL_FANOUT", "0") == "1"
+FANOUT_MAX_WORKERS = int(os.environ.get("FANOUT_MAX_WORKERS", "8"))
+# seconds left for filtering, packing and returning after the fan-out stops waiting
+FANOUT_SAFETY_SECONDS = 10
+# resources retrieved at once by batch_handler
+BATCH_MAX_WORKERS = int(os.environ.get("BATCH_MAX_WORKERS", "4"))
+# BEDROCK_ENDPOINT_URL points the client at a local stand-in such as fake_bedrock.py
+ENDPOINT_URL = os.environ.get("BEDROCK_ENDPOINT_URL")
+# LOCAL_INDEX searches an index built by the repository's local_index.py instead of the knowledge base,
+# for local runs with the repository root on PYTHONPATH
+LOCAL_INDEX = os.environ.get("LOCAL_INDEX")
 
-    # Connect to AWS Bedrock
-    session = boto3.Session()
+CLIENT_CONFIG = Config(
+    max_pool_connections=int(os.environ.get("BEDROCK_MAX_POOL_CONNECTIONS", "10")),
+    tcp_keepalive=True,
+    connect_timeout=5,
+    read_timeout=60,
+    retries={"max_attempts": 3, "mode": "standard"},
+)
 
-    model_id = 'anthropic.claude-3-sonnet-20240229-v1:0'
-    region_id = region_name 
+logger = get_logger("lambda_function")
 
-    bedrock_client = session.client("bedrock-agent-runtime", region_name=region_name)
+# X-Ray subsegments when the daemon is there (Tracing: Active), plus one JSON timing line per invocation
+tracer = Tracer(emit=logger.info)
 
-    kbId = 'ZMHF67DY2R'
+# per-container cache of retrieve results, optionally backed by a shared table (CACHE_TABLE)
+retrieval_cache = cache.from_environment()
 
-    model_arn = f'arn:aws:bedrock:{region_id}::foundation-model/{model_id}'
-    
-    # result_text = bedrock_client.retrieve_and_generate(
-    #         input={
-    #             'text': input
-    #         },
-    #         retrieveAndGenerateConfiguration={
-    #             'type': 'KNOWLEDGE_BASE',
-    #             'knowledgeBaseConfiguration': {
-    #                 'knowledgeBaseId': kbId,
-    #                 'modelArn': model_arn,
-    #                 'generationConfiguration': {
-    #                     'inferenceConfig': {
-    #                         'textInferenceConfig': {
-    #                             'maxTokens': 4096,
-    #                             #please note that these temperature and topP values are somewhat arbitrary and may need to be adjusted
-    #                             'temperature': 0.2,
-    #                             'topP': 0.9
-    #                         }
-    #                     }
-    #                 },
-    #                 'retrievalConfiguration': {
-    #                     'vectorSearchConfiguration': {
-    #                          'numberOfResults': 50
-    #                         }
-    #                     }
-    #                 }
-
-    #             }
-
-    #     )
-    
-    # print(result_text.get('citations'))
-    
-    # responseBody = {
-    #     'TEXT' : { 
-    #         "body" : str(result_text.get('citations'))
-            
-    #     }
-        
-    # }
+_bedrock_client = None
+_bedrock_client_lock = threading.Lock()
 
 
-    response = bedrock_client.retrieve(
-              knowledgeBaseId = kbId,
-              retrievalQuery={
-                'text': input
-                },
-                retrievalConfiguration={
-                      'vectorSearchConfiguration': {
-                            'numberOfResults': 50,
-                            'overrideSearchType' : 'HYBRID'
-                            }
-                        }
+def get_bedrock_client():
+    # built on the first invocation and kept at module scope, so warm invocations reuse the
+    # loaded service model, resolved endpoint and open keep-alive connections
+    global _bedrock_client
+    if _bedrock_client is None:
+        with _bedrock_client_lock:
+            if _bedrock_client is None:
+                with tracer.stage("client_init"):
+                    if LOCAL_INDEX:
+                        from local_index import LocalIndex, LocalRetrieveClient
+
+                        _bedrock_client = LocalRetrieveClient(LocalIndex.load(LOCAL_INDEX))
+                    else:
+                        _bedrock_client = boto3.client(
+                            "bedrock-agent-runtime", region_name=REGION, endpoint_url=ENDPOINT_URL, config=CLIENT_CONFIG
                         )
+    return _bedrock_client
+
+
+RETRIEVAL_CONFIGURATION = {
+    'vectorSearchConfiguration': {
+        'numberOfResults': 50,
+        'overrideSearchType': 'HYBRID'
+    }
+}
+
+
+def retrieve(text):
+    # the agent repeats the same search on follow-up turns, so results are cached per normalized query
+    key = cache_key(text, KB_ID, RETRIEVAL_CONFIGURATION)
+    with tracer.stage("cache_lookup") as span:
+        retrievalResults = retrieval_cache.get(key)
+        span.annotate("hits", 0 if retrievalResults is None else 1)
+    if retrievalResults is None:
+        bedrock_client = get_bedrock_client()
+        with tracer.stage("retrieve") as span:
+            response = bedrock_client.retrieve(
+                knowledgeBaseId=KB_ID,
+                retrievalQuery={
+                    'text': text
+                },
+                retrievalConfiguration=RETRIEVAL_CONFIGURATION
+            )
+            retrievalResults = response.get('retrievalResults')
+            span.annotate("results", len(retrievalResults or []))
+        retrieval_cache.put(key, retrievalResults)
+    else:
+        logger.debug("Retrieval cache hit")
+    return retrievalResults
+
+
+fanout = FanOut(retrieve, max_workers=FANOUT_MAX_WORKERS)
+
+# where batch_handler writes packed results: RESULTS_BUCKET (S3) or RESULTS_DIR (local); None disables it
+results_store = results.from_environment()
+# separate from the fan-out pool, whose searches the batch's resources wait on
+batch_executor = ThreadPoolExecutor(max_workers=BATCH_MAX_WORKERS)
 
-    result_text = str(response.get('retrievalResults'))
-    #truncate response to under 25 kb
-    if len(result_text) > 20000:
-        result_text = result_text[:20000] + "..."
-        print(result_text)
+
+def search_resource(query_dict, timeout=None):
+    """Retrieves, filters and packs the knowledge base results for one resource. Returns the packed JSON text.
+
+    timeout bounds how long the fan-out waits for its searches, in seconds.
+    """
+    input = build_query(query_dict)
+    logger.info("Query: %s", input)
+
+    names = split_names(query_dict['resourcename'], query_dict.get('synonyms'))
+    queries = name_queries(names, query_dict.get('resourcetype'), query_dict.get('rrid'))
+
+    if RETRIEVAL_FANOUT and len(queries) > 1:
+        # one search per name variant, merged by reciprocal rank
+        with tracer.stage("fanout", queries=len(queries)) as span:
+            retrievalResults, failed = fanout.search(queries, timeout=timeout)
+            span.annotate("failed", failed)
+        logger.info("Fan-out over %d queries, %d failed or timed out", len(queries), failed)
+    else:
+        retrievalResults = retrieve(input)
+
+    with tracer.stage("filter") as span:
+        relevantResults, removed = filter_results(retrievalResults, names, mode=RELEVANCE_FILTER)
+        span.annotate("results", len(retrievalResults or []))
+        span.annotate("dropped", removed if RELEVANCE_FILTER == "drop" else 0)
+    if removed:
+        logger.info("%d of %d chunks do not mention %s", removed, len(retrievalResults), names)
+    notes = {"chunksWithoutNameMatch": removed, "nameMatchMode": RELEVANCE_FILTER}
+
+    # compact JSON with whole results, kept under the 25 KB action group response limit
+    with tracer.stage("serialize") as span:
+        result_text, packed = pack_results(relevantResults, max_bytes=MAX_RESULT_BYTES, presorted=True, notes=notes)
+        span.annotate("results", packed)
+        # results that did not fit in MAX_RESULT_BYTES
+        span.annotate("truncated", len(relevantResults) - packed)
+        span.annotate("payloadBytes", len(result_text.encode("utf-8")))
+    if packed < len(relevantResults):
+        logger.info("Packed %d of %d results into %d bytes", packed, len(relevantResults), len(result_text.encode("utf-8")))
+    log_payload(logger, "Results", result_text)
+    return result_text
+
+
+def remaining_seconds(context):
+    # time left before the function times out, less what filtering, packing and returning need
+    if context is None:
+        return None
+    return max(1.0, context.get_remaining_time_in_millis() / 1000 - FANOUT_SAFETY_SECONDS)
+
+
+def lambda_handler(event, context):
+    agent = event['agent']
+    actionGroup = event['actionGroup']
+    function = event['function']
+    query = event.get('parameters', [])
+    
+    query_dict = {param['name'].lower(): str(param['value']) for param in query}
+
+    with tracer.invocation("lambda_handler", context):
+        result_text = search_resource(query_dict, timeout=remaining_seconds(context))
 
     responseBody = {
         'TEXT' : { 
@@ -112,6 +193,65 @@ def lambda_handler(event, context):
     }
 
     dummy_function_response = {'response': action_response, 'messageVersion': event['messageVersion']}
-    print("Response: {}".format(dummy_function_response))
+    # the results were already logged (sampled, or as a preview); the rest of the response is fixed fields
+    logger.info("Responding to %s with %d bytes", function, len(result_text.encode("utf-8")))
 
     return dummy_function_response
+
+
+def parse_message(body):
+    """An SQS message body is a JSON object with the agent's parameters: resourceName, resourceType, synonyms, rrid,
+    plus the resourceId the stored results are named after."""
+    message = json.loads(body)
+    if not isinstance(message, dict):
+        raise ValueError("message body is not a JSON object")
+    query_dict = {name.lower(): str(value) for name, value in message.items() if value is not None}
+    if 'resourcename' not in query_dict or 'resourceid' not in query_dict:
+        raise ValueError("message needs resourceName and resourceId")
+    return query_dict
+
+
+def process_message(record, timeout, abandoned=None):
+    query_dict = parse_message(record['body'])
+    result_text = search_resource(query_dict, timeout=timeout)
+    # a message already reported as failed is redelivered by SQS; its late results are not stored
+    if abandoned is not None and abandoned.is_set():
+        raise TimeoutError("Message abandoned at the end of its batch")
+    with tracer.stage("store") as span:
+        location = results_store.put(query_dict['resourceid'], result_text)
+        span.annotate("payloadBytes", len(result_text.encode("utf-8")))
+    logger.info("Stored results for %s at %s", query_dict['resourceid'], location)
+
+
+def batch_handler(event, context):
+    """SQS entry point: prefetches retrievals for a batch of resources and stores the packed results.
+
+    Messages that fail, or are still running when the function is about to time out, are reported
+    back as batchItemFailures so SQS redelivers only those. Their queued work is cancelled. A search
+    already running cannot be interrupted: with RETRIEVAL_FANOUT it stops waiting at the same deadline,
+    but a single query runs until the client's own limits (CLIENT_CONFIG: 5 s to connect, 60 s to read,
+    3 attempts). Either way it skips storing once its message is reported, so it does not race the
+    redelivered message; one that passed that check just before writes the key the redelivery overwrites.
+    """
+    if results_store is None:
+        raise RuntimeError("Set RESULTS_BUCKET or RESULTS_DIR to store batch results")
+    records = event.get('Records', [])
+    timeout = remaining_seconds(context)
+    abandoned = threading.Event()
+    with tracer.invocation("batch_handler", context):
+        futures = {batch_executor.submit(process_message, record, timeout, abandoned): record['messageId'] for record in records}
+        done, not_done = wait(futures, timeout=timeout)
+        abandoned.set()
+        for future in not_done:
+            future.cancel()
+            logger.warning("Message %s did not finish in time", futures[future])
+
+    failures = [futures[future] for future in not_done]
+    for future in done:
+        try:
+            future.result()
+        except Exception as e:
+            logger.warning("Message %s failed: %s", futures[future], e)
+            failures.append(futures[future])
+    logger.info("Batch of %d messages, %d failed", len(records), len(failures))
+    return {'batchItemFailures': [{'itemIdentifier': messageId} for messageId in failures]}
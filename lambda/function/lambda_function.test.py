@@ -0,0 +1,341 @@
+## tests and benchmark for lambda_function against a stubbed retrieve backend, no AWS needed
+##
+##   python3 function/lambda_function.test.py                        # tests (0-run-tests.sh)
+##   python3 function/lambda_function.test.py --bench -n 200         # p50/p95 latency, payload size and allocations per stage
+##   python3 function/lambda_function.test.py --bench --fanout --latency 40
+
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import unittest
+from contextlib import contextmanager
+
+# quiet by default; the benchmark measures the handler, not log output
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.pop("RESULTS_BUCKET", None)
+os.environ.pop("CACHE_TABLE", None)
+
+import lambda_function
+import relevance
+import retrieval_cache
+import results_store
+from tracing import NoOpRecorder, Tracer
+
+# resources as the agent sends them: name, type, synonyms and RRID as found in the tools table
+RESOURCES = [
+    {"resourceName": "NF1C-FiPS-SV4F7", "resourceType": "Cell Line", "synonyms": "NF1(-/-) FiPS Ctrl1-SV4F-7"},
+    {"resourceName": "ipNF95.11bC", "resourceType": "Cell Line", "synonyms": "ipNF95.11b C", "rrid": "CVCL_UI72"},
+    {"resourceName": "SK-MEL-2", "resourceType": "Cell Line", "rrid": "CVCL_0069"},
+    {"resourceName": "Nf1flox/flox;Dhh-Cre", "resourceType": "Animal Model", "synonyms": "DhhCre;Nf1fl/fl, Dhh-Cre Nf1 flox"},
+    {"resourceName": "ST88-14", "resourceType": "Cell Line", "synonyms": "ST8814, ST88.14", "rrid": "CVCL_8916"},
+    {"resourceName": "anti-neurofibromin antibody (D7R7D)", "resourceType": "Antibody", "rrid": "AB_2611181"},
+    {"resourceName": "Nf1+/-", "resourceType": "Animal Model", "synonyms": "Nf1 heterozygous mouse"},
+    {"resourceName": "U87-MG", "resourceType": "Cell Line", "synonyms": '["U87MG", "U-87 MG"]', "rrid": "CVCL_0022"},
+]
+
+WORDS = (
+    "tumor cells were cultured in DMEM supplemented with fetal bovine serum and treated with selumetinib "
+    "for 72 hours before western blot analysis of phosphorylated ERK levels in plexiform neurofibroma "
+    "xenografts compared with vehicle controls across three independent experiments"
+).split()
+
+
+def action_group_event(resource, function="search_knowledgebase"):
+    return {
+        "messageVersion": "1.0",
+        "agent": {"name": "nftc-extractor", "id": "AGENT12345", "alias": "TSTALIASID", "version": "DRAFT"},
+        "sessionId": "123456789012345",
+        "sessionAttributes": {},
+        "promptSessionAttributes": {},
+        "inputText": "Tell me about {}".format(resource["resourceName"]),
+        "actionGroup": "knowledgebase-search",
+        "function": function,
+        "parameters": [{"name": name, "type": "string", "value": value} for name, value in resource.items()],
+    }
+
+
+def sqs_event(messages):
+    return {"Records": [
+        {"messageId": "msg-{}".format(i), "body": body, "eventSource": "aws:sqs"}
+        for i, body in enumerate(messages)
+    ]}
+
+
+class StubBedrockClient:
+    """Answers retrieve like bedrock-agent-runtime: numberOfResults chunks with S3 locations and DOI metadata,
+    about a third of them mentioning a resource named in the query."""
+
+    def __init__(self, latency=0.0, seed=0):
+        self.latency = latency
+        self.seed = seed
+        self.calls = 0
+        # fan-out searches call retrieve from several threads
+        self._lock = threading.Lock()
+
+    def retrieve(self, knowledgeBaseId, retrievalQuery, retrievalConfiguration):
+        with self._lock:
+            self.calls += 1
+        if self.latency:
+            time.sleep(self.latency)
+        text = retrievalQuery["text"]
+        k = retrievalConfiguration["vectorSearchConfiguration"]["numberOfResults"]
+        rng = random.Random("{}:{}".format(self.seed, text))
+        named = [r["resourceName"] for r in RESOURCES if r["resourceName"].lower() in text.lower()]
+        results = []
+        for rank in range(k):
+            words = rng.choices(WORDS, k=rng.randint(40, 220))
+            if named and rank % 3 == 0:
+                words.insert(rng.randrange(len(words)), named[0])
+            doi = "10.1038/s41467-0{:02d}-{:05d}".format(rng.randrange(24), rng.randrange(100000))
+            uri = "s3://nf-tools-database-publications/nftc_pdfs/nftc_{}.pdf".format(doi.replace("/", "_"))
+            results.append({
+                "content": {"text": " ".join(words)},
+                "location": {"type": "S3", "s3Location": {"uri": uri}},
+                "metadata": {"x-amz-bedrock-kb-source-uri": uri, "doi": ["https://www.doi.org/" + doi]},
+                "score": round(0.9 * 0.98 ** rank, 6),
+            })
+        return {"retrievalResults": results}
+
+
+class Context:
+    aws_request_id = "local"
+
+    def get_remaining_time_in_millis(self):
+        return 180000
+
+
+def use_backend(client, cache=False):
+    lambda_function._bedrock_client = client
+    # max_entries=0 keeps nothing, so every call goes to the backend
+    lambda_function.retrieval_cache = retrieval_cache.RetrievalCache(retrieval_cache.MemoryCache(max_entries=256 if cache else 0))
+
+
+def response_body(response):
+    return json.loads(response["response"]["functionResponse"]["responseBody"]["TEXT"]["body"])
+
+
+class TestFunction(unittest.TestCase):
+
+    def setUp(self):
+        self.client = StubBedrockClient()
+        use_backend(self.client)
+        lambda_function.tracer = Tracer(recorder=NoOpRecorder(), emit=lambda line: None)
+        lambda_function.RETRIEVAL_FANOUT = False
+        lambda_function.RELEVANCE_FILTER = "drop"
+
+    def test_response_shape(self):
+        event = action_group_event(RESOURCES[0])
+        response = lambda_function.lambda_handler(event, Context())
+        self.assertEqual(response["messageVersion"], "1.0")
+        self.assertEqual(response["response"]["actionGroup"], event["actionGroup"])
+        self.assertEqual(response["response"]["function"], event["function"])
+        body = response_body(response)
+        self.assertTrue(body["results"])
+        self.assertEqual(body["nameMatchMode"], "drop")
+
+    def test_body_within_budget(self):
+        lambda_function.RELEVANCE_FILTER = "off"
+        response = lambda_function.lambda_handler(action_group_event(RESOURCES[3]), Context())
+        text = response["response"]["functionResponse"]["responseBody"]["TEXT"]["body"]
+        self.assertLessEqual(len(text.encode("utf-8")), lambda_function.MAX_RESULT_BYTES)
+        self.assertGreater(response_body(response)["omitted"], 0)
+
+    def test_drops_chunks_without_the_name(self):
+        resource = RESOURCES[1]
+        body = response_body(lambda_function.lambda_handler(action_group_event(resource), Context()))
+        self.assertGreater(body["chunksWithoutNameMatch"], 0)
+        for result in body["results"]:
+            self.assertIn(resource["resourceName"], result["text"])
+
+    def test_fanout_one_search_per_name(self):
+        lambda_function.RETRIEVAL_FANOUT = True
+        resource = RESOURCES[7]
+        body = response_body(lambda_function.lambda_handler(action_group_event(resource), Context()))
+        # the name, two synonyms and the RRID
+        self.assertEqual(self.client.calls, 4)
+        texts = [result["text"] for result in body["results"]]
+        self.assertEqual(len(texts), len(set(texts)))
+
+    def test_cache_hit_skips_backend(self):
+        use_backend(self.client, cache=True)
+        event = action_group_event(RESOURCES[2])
+        first = lambda_function.lambda_handler(event, Context())
+        second = lambda_function.lambda_handler(event, Context())
+        self.assertEqual(self.client.calls, 1)
+        self.assertEqual(response_body(first), response_body(second))
+
+    def test_batch_reports_failed_messages(self):
+        with tempfile.TemporaryDirectory() as directory:
+            lambda_function.results_store = results_store.LocalStore(directory)
+            messages = [json.dumps(dict(RESOURCES[0], resourceId="00f8dcc6-a2b2-4fc2-a327-e87367bffa21")), "not json",
+                        json.dumps({"resourceName": "no id"})]
+            with self.assertLogs("lambda_function", level="WARNING"):
+                response = lambda_function.batch_handler(sqs_event(messages), Context())
+            self.assertEqual(sorted(f["itemIdentifier"] for f in response["batchItemFailures"]), ["msg-1", "msg-2"])
+            self.assertEqual(os.listdir(directory), ["00f8dcc6-a2b2-4fc2-a327-e87367bffa21.json"])
+
+    def test_batch_abandons_late_messages(self):
+        release = threading.Event()
+
+        class HeldClient(StubBedrockClient):
+            # searches for SK-MEL-2 stay running until the test releases them, however long the handler waits
+            def retrieve(self, knowledgeBaseId, retrievalQuery, retrievalConfiguration):
+                if RESOURCES[2]["resourceName"] in retrievalQuery["text"]:
+                    release.wait()
+                return super().retrieve(knowledgeBaseId, retrievalQuery, retrievalConfiguration)
+
+        class ShortContext(Context):
+            # 1 second of search time after the safety margin
+            def get_remaining_time_in_millis(self):
+                return (lambda_function.FANOUT_SAFETY_SECONDS + 1) * 1000
+
+        finished = threading.Semaphore(0)
+        process_message = lambda_function.process_message
+
+        def counted(*args):
+            try:
+                return process_message(*args)
+            finally:
+                finished.release()
+
+        use_backend(HeldClient())
+        # release held searches even if an assertion fails, so the batch pool's threads can exit
+        self.addCleanup(release.set)
+        lambda_function.process_message = counted
+        self.addCleanup(setattr, lambda_function, "process_message", process_message)
+        workers = lambda_function.BATCH_MAX_WORKERS
+        with tempfile.TemporaryDirectory() as directory:
+            lambda_function.results_store = results_store.LocalStore(directory)
+            # two quick messages, then held ones: a worker's worth running past the deadline and a worker's worth queued
+            messages = [json.dumps(dict(RESOURCES[0], resourceId="quick-{}".format(i))) for i in range(2)]
+            messages += [json.dumps(dict(RESOURCES[2], resourceId="held-{}".format(i))) for i in range(2 * workers)]
+            with self.assertLogs("lambda_function", level="WARNING"):
+                response = lambda_function.batch_handler(sqs_event(messages), ShortContext())
+            self.assertEqual(sorted(f["itemIdentifier"] for f in response["batchItemFailures"]),
+                             sorted("msg-{}".format(i) for i in range(2, 2 + 2 * workers)))
+            # the running ones finish after the handler returned; the queued ones were cancelled and never start
+            release.set()
+            for _ in range(2 + workers):
+                self.assertTrue(finished.acquire(timeout=10))
+            self.assertEqual(sorted(os.listdir(directory)), ["quick-0.json", "quick-1.json"])
+
+
+class TestNameMatching(unittest.TestCase):
+
+    def assertMatches(self, names, text, expected):
+        # the lambda's regex and the scanner mention_index.py uses must agree
+        pattern = relevance.name_pattern(names)
+        scanner = relevance.NameScanner(relevance.name_key(n) for n in names)
+        self.assertEqual([m.group() for m in pattern.finditer(text)], expected)
+        self.assertEqual([text[start:end] for _, start, end in scanner.scan(text)], expected)
+
+    def test_joined_and_separated_names_match(self):
+        self.assertMatches(["SK-MEL-2"], "SKMEL2 and sk mel 2 cells", ["SKMEL2", "sk mel 2"])
+        self.assertMatches(["SKMEL2"], "SKMEL-2 and SK-MEL-2 cells", ["SKMEL-2"])
+        self.assertMatches(["ipNF95.11b C"], "ipNF95.11bC", ["ipNF95.11bC"])
+        self.assertMatches(["ipNF95.11bC", "ipNF95.11b C"], "ipNF95.11b C and IPNF95.11BC", ["ipNF95.11b C", "IPNF95.11BC"])
+        self.assertMatches(["NF90-8", "HCT 116"], "NF90-8, NF90.8, HCT116 and HCT-116", ["NF90-8", "NF90.8", "HCT116", "HCT-116"])
+
+    def test_names_do_not_match_inside_others(self):
+        self.assertMatches(["SK-MEL-2"], "SK-MEL-238, SK-MEL-2b and xSK-MEL-2", [])
+        self.assertMatches(["SK-MEL-2", "SK-MEL-238"], "SK-MEL-238 then SK-MEL-2", ["SK-MEL-238", "SK-MEL-2"])
+        self.assertMatches(["NF1"], "NF1C-FiPS-SV4F7, Nf1+/- mice", ["Nf1"])
+
+    def test_digit_runs_are_not_joined(self):
+        self.assertMatches(["SK-MEL-238"], "SK-MEL-2 3.8 and SK-MEL-2 (38%)", [])
+        self.assertMatches(["HCT 116"], "HCT 1, 16", [])
+        self.assertMatches(["ST88-14"], "ST88 1.4", [])
+        self.assertMatches(["NF90-8"], "NF90 8 and NF908", [])
+        self.assertMatches(["S462"], "Fig S4 62", [])
+
+
+class AllocationTracer(Tracer):
+    """Also records, per stage, the bytes allocated and still held at its end and the peak above its start.
+    Stages that overlap (fan-out searches) share tracemalloc's single peak, so theirs are approximate."""
+
+    def __init__(self):
+        super().__init__(recorder=NoOpRecorder(), emit=lambda line: None)
+        self.allocations = {}
+
+    @contextmanager
+    def stage(self, name, **annotations):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        with super().stage(name, **annotations) as span:
+            yield span
+        after, peak = tracemalloc.get_traced_memory()
+        self.allocations.setdefault(name, []).append((after - current, peak - current))
+
+
+def percentile(values, q):
+    if len(values) == 1:
+        return values[0]
+    return statistics.quantiles(values, n=100, method="inclusive")[q - 1]
+
+
+def benchmark(n, latency, fanout, cache, seed):
+    lambda_function.RETRIEVAL_FANOUT = fanout
+    rng = random.Random(seed)
+    events = [action_group_event(rng.choice(RESOURCES)) for _ in range(n)]
+
+    # pass 1, latency: the timing line each invocation logs
+    summaries = []
+    tracer = Tracer(recorder=NoOpRecorder(), emit=lambda line: summaries.append(json.loads(line)))
+    lambda_function.tracer = tracer
+    use_backend(StubBedrockClient(latency=latency, seed=seed), cache=cache)
+    handler_ms = []
+    payloads = []
+    for event in events:
+        start = time.perf_counter()
+        response = lambda_function.lambda_handler(event, Context())
+        handler_ms.append((time.perf_counter() - start) * 1000)
+        payloads.append(len(json.dumps(response).encode("utf-8")))
+
+    # pass 2, allocations: tracemalloc slows everything down, so it gets its own run
+    tracer = AllocationTracer()
+    lambda_function.tracer = tracer
+    use_backend(StubBedrockClient(latency=latency, seed=seed), cache=cache)
+    tracemalloc.start()
+    for event in events:
+        lambda_function.lambda_handler(event, Context())
+    tracemalloc.stop()
+
+    stages = {}
+    for summary in summaries:
+        for name, stage in summary["stages"].items():
+            stages.setdefault(name, []).append(stage["ms"])
+
+    print("{} invocations, fan-out {}, cache {}, backend latency {:.0f} ms".format(
+        n, "on" if fanout else "off", "on" if cache else "off", latency * 1000))
+    # times are per invocation, summed over the stage's calls; allocations are per call
+    print("{:<14}{:>6}{:>10}{:>10}{:>14}{:>14}".format("stage", "n", "p50 ms", "p95 ms", "held KB/call", "peak KB/call"))
+    for name, values in stages.items():
+        allocations = tracer.allocations.get(name, [(0, 0)])
+        print("{:<14}{:>6}{:>10.2f}{:>10.2f}{:>14.1f}{:>14.1f}".format(
+            name, len(values), percentile(values, 50), percentile(values, 95),
+            statistics.mean(a[0] for a in allocations) / 1024, statistics.mean(a[1] for a in allocations) / 1024))
+    print("{:<14}{:>6}{:>10.2f}{:>10.2f}".format("handler", n, percentile(handler_ms, 50), percentile(handler_ms, 95)))
+    print("response bytes: p50 {:.0f}, p95 {:.0f}, max {}".format(percentile(payloads, 50), percentile(payloads, 95), max(payloads)))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Test or benchmark lambda_function against a stubbed retrieve backend")
+    parser.add_argument("--bench", action="store_true", help="benchmark instead of running the tests")
+    parser.add_argument("-n", type=int, default=100, help="invocations to benchmark")
+    parser.add_argument("--latency", type=float, default=0, help="simulated retrieve latency in ms")
+    parser.add_argument("--fanout", action="store_true", help="one search per name variant (RETRIEVAL_FANOUT=1)")
+    parser.add_argument("--cache", action="store_true", help="keep the retrieval cache on")
+    parser.add_argument("--seed", type=int, default=0)
+    args, rest = parser.parse_known_args()
+
+    if args.bench:
+        benchmark(args.n, args.latency / 1000, args.fanout, args.cache, args.seed)
+    else:
+        unittest.main(argv=[sys.argv[0]] + rest)
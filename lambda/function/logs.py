@@ -0,0 +1,38 @@
+import logging
+import os
+import random
+
+# LOG_LEVEL: DEBUG, INFO (default), WARNING, ...
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO").upper()
+# LOG_PAYLOADS=1 logs whole payloads (search results, responses); otherwise only capped previews at DEBUG
+LOG_PAYLOADS = os.environ.get("LOG_PAYLOADS", "0") == "1"
+# with LOG_PAYLOADS, log the whole payloads of 1 in LOG_SAMPLE_RATE calls
+LOG_SAMPLE_RATE = max(1, int(os.environ.get("LOG_SAMPLE_RATE", "1")))
+PREVIEW_CHARS = int(os.environ.get("LOG_PREVIEW_CHARS", "300"))
+
+if not logging.getLogger().handlers:
+    # Lambda's runtime installs its own handler on the root logger; this is for local runs
+    logging.basicConfig(format="%(levelname)s %(name)s %(message)s")
+
+
+def get_logger(name):
+    logger = logging.getLogger(name)
+    logger.setLevel(LOG_LEVEL)
+    return logger
+
+
+def preview(text, limit=PREVIEW_CHARS):
+    if len(text) <= limit:
+        return text
+    return "{}... ({} more characters)".format(text[:limit], len(text) - limit)
+
+
+def log_payload(logger, label, text):
+    """Logs text whole when LOG_PAYLOADS is set and this call is sampled, otherwise a preview at DEBUG.
+
+    Nothing is formatted unless it will be written, so a payload costs nothing at the default level.
+    """
+    if LOG_PAYLOADS and random.randrange(LOG_SAMPLE_RATE) == 0:
+        logger.info("%s (%d characters): %s", label, len(text), text)
+    elif logger.isEnabledFor(logging.DEBUG):
+        logger.debug("%s: %s", label, preview(text))
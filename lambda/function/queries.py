@@ -0,0 +1,27 @@
+# how a resource is phrased as a knowledge base search; batch_retrieve.py loads this too, so it must not import boto3
+
+
+def build_query(query_dict):
+    """The one search the agent's parameters make: the name, its type, synonyms and RRID as the agent sent them."""
+    input = "Tell me about {}".format(query_dict['resourcename'])
+    if 'resourcetype' in query_dict:
+        input += " {}".format(query_dict['resourcetype'])
+    if 'synonyms' in query_dict:
+        input += " also known as {}".format(query_dict['synonyms'])
+    if 'rrid' in query_dict:
+        input += " also known as RRID:{}".format(query_dict['rrid'])
+    return input
+
+
+def name_queries(names, resourcetype=None, rrid=None):
+    """One search query per name variant (the name and each synonym), plus one for the RRID."""
+    queries = []
+    for name in names:
+        query = "Tell me about {}".format(name)
+        if resourcetype:
+            query += " {}".format(resourcetype)
+        queries.append(query)
+    if rrid:
+        queries.append("Tell me about RRID:{}".format(rrid))
+    # drop repeats, keeping the order
+    return list(dict.fromkeys(queries))
@@ -0,0 +1,142 @@
+import json
+import re
+
+_ALNUM = re.compile(r"[A-Za-z0-9]")
+# a name's letter and digit runs: SK-MEL-238 -> sk, mel, 238
+_RUN = re.compile(r"[A-Za-z]+|[0-9]+")
+# what may stand between two runs in the text: anything but letters and digits (nothing, spaces, hyphens, dots, ...),
+# except between two digit runs, which need a mark other than a space, so NF90-8 is not found in "NF90 8" or "NF908"
+_SEPARATOR = r"[^A-Za-z0-9]*"
+_DIGIT_SEPARATOR = r"[^A-Za-z0-9\s]+"
+_DIGIT_GAP = re.compile(_DIGIT_SEPARATOR, re.ASCII)
+
+
+def split_names(resourcename, synonyms=None):
+    """The resource name plus its synonyms; synonyms arrive as a list (the tools table from Synapse),
+    a JSON list or a comma-separated string. Missing values (None, NaN) are skipped."""
+    names = [resourcename.strip()] if isinstance(resourcename, str) and resourcename.strip() else []
+    if isinstance(synonyms, str):
+        parsed = None
+        if synonyms.strip().startswith("["):
+            try:
+                parsed = json.loads(synonyms)
+            except json.JSONDecodeError:
+                pass
+        if not isinstance(parsed, list):
+            parsed = synonyms.split(",")
+    elif isinstance(synonyms, (list, tuple)):
+        parsed = synonyms
+    else:
+        parsed = []
+    names.extend(str(s).strip() for s in parsed if str(s).strip())
+    return names
+
+
+def name_key(name):
+    """A name as its lowercased letter and digit runs, split wherever letters meet digits or the name has a break:
+    FTC-133, FTC133 and ftc 133 are all "ftc 133", SK-MEL-2 is "sk mel 2" and SKMEL2 is "skmel 2"."""
+    return " ".join(_RUN.findall(name or "")).lower()
+
+
+def _digit_run(run):
+    return run[0].isdigit()
+
+
+def name_pattern(names):
+    """One case-insensitive regex matching any of the names, ignoring case and the punctuation and spacing
+    between their runs.
+
+    Each letter or digit run of a name must appear unbroken. Where letters meet digits, or the name itself
+    has a break between two runs, the text may separate them by anything but letters and digits, or not at
+    all: FTC133 matches FTC-133, U87 MG matches U87MG and SK-MEL-2 matches SKMEL2 (but SKMEL2 does not match
+    SK-MEL-2). Two digit runs need a mark between them other than a space, so NF90-8 matches NF90.8 but not
+    "NF90 8", and a digit run is never split, so HCT 116 does not match "HCT 1, 16". The match must not
+    continue into another letter or digit, so SK-MEL-2 does not match SK-MEL-238.
+    """
+    alternatives = []
+    for name in names:
+        runs = name_key(name).split()
+        if runs:
+            pattern = re.escape(runs[0])
+            for before, run in zip(runs, runs[1:]):
+                pattern += (_DIGIT_SEPARATOR if _digit_run(before) and _digit_run(run) else _SEPARATOR) + re.escape(run)
+            alternatives.append(("".join(runs), pattern))
+    if not alternatives:
+        return None
+    # longest first, so a longer name wins over a shorter prefix of it
+    alternatives.sort(key=lambda a: len(a[0]), reverse=True)
+    return re.compile(r"(?<![A-Za-z0-9])(?:{})(?![A-Za-z0-9])".format("|".join(p for _, p in alternatives)),
+                      re.IGNORECASE | re.ASCII)
+
+
+class NameScanner:
+    """Finds any of many names in a text by the same rules as name_pattern, for name lists too long for one regex.
+
+    The text is reduced to its letters and digits once; at each point where a word starts, the name keys
+    of every length are looked up in a dict by their letters and digits, longest first, and a candidate
+    is kept if its runs are unbroken in the text and the gaps between them are allowed.
+    """
+
+    def __init__(self, keys):
+        self.keys = {}
+        for key in keys:
+            if key:
+                runs = key.split()
+                self.keys.setdefault("".join(runs), []).append((key, [len(run) for run in runs], [_digit_run(run) for run in runs]))
+        self.lengths = sorted({len(compact) for compact in self.keys}, reverse=True)
+
+    @staticmethod
+    def _fits(text, offsets, i, lengths, digits):
+        # each run unbroken from compact position i on, and two digit runs apart by a mark other than a space
+        for k, length in enumerate(lengths):
+            if offsets[i + length - 1] - offsets[i] != length - 1:
+                return False
+            i += length
+            if k + 1 < len(lengths) and digits[k] and digits[k + 1] and not _DIGIT_GAP.fullmatch(text, offsets[i - 1] + 1, offsets[i]):
+                return False
+        return True
+
+    def scan(self, text):
+        """(key, start, end) for every name found, with start and end character offsets in text."""
+        offsets = [m.start() for m in _ALNUM.finditer(text)]
+        compact = "".join(text[o] for o in offsets).lower()
+        n = len(compact)
+        found = []
+        i = 0
+        while i < n:
+            # a name may only start where the text's letters and digits do not run on from before
+            if i == 0 or offsets[i - 1] + 1 != offsets[i]:
+                match = None
+                for length in self.lengths:
+                    j = i + length
+                    # ... and only end where they do not run on after, so SK-MEL-2 is not found in SK-MEL-238
+                    if j <= n and (j == n or offsets[j - 1] + 1 != offsets[j]):
+                        for key, lengths, digits in self.keys.get(compact[i:j], ()):
+                            if self._fits(text, offsets, i, lengths, digits):
+                                match = key
+                                break
+                    if match:
+                        found.append((match, offsets[i], offsets[j - 1] + 1))
+                        i = j - 1
+                        break
+            i += 1
+        return found
+
+
+def filter_results(results, names, mode="drop"):
+    """Drops (mode "drop") or moves to the end (mode "rank") the results whose text never mentions a name.
+
+    Both groups come back best score first. Returns (results, number of results without a mention).
+    """
+    results = sorted(results or [], key=lambda r: r.get("score") or 0, reverse=True)
+    pattern = name_pattern(names)
+    if pattern is None or mode == "off":
+        return results, 0
+    matched = []
+    unmatched = []
+    for result in results:
+        text = (result.get("content") or {}).get("text", "")
+        (matched if pattern.search(text) else unmatched).append(result)
+    if mode == "rank":
+        return matched + unmatched, len(unmatched)
+    return matched, len(unmatched)
@@ -0,0 +1,56 @@
+import os
+import re
+import tempfile
+
+# resourceIds are UUIDs, but anything else in a message is made safe to use as a file or object name
+_UNSAFE = re.compile(r"[^A-Za-z0-9._-]+")
+
+
+def result_name(resource_id):
+    return "{}.json".format(_UNSAFE.sub("_", resource_id))
+
+
+class S3Store:
+    """Writes each resource's packed results to s3://bucket/prefix<resourceId>.json."""
+
+    def __init__(self, bucket, prefix="", endpoint_url=None):
+        import boto3
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self._client = boto3.client("s3", endpoint_url=endpoint_url)
+
+    def put(self, resource_id, text):
+        key = self.prefix + result_name(resource_id)
+        self._client.put_object(Bucket=self.bucket, Key=key, Body=text.encode("utf-8"), ContentType="application/json")
+        return "s3://{}/{}".format(self.bucket, key)
+
+
+class LocalStore:
+    """Writes each resource's packed results to directory/<resourceId>.json, for local runs."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def put(self, resource_id, text):
+        path = os.path.join(self.directory, result_name(resource_id))
+        # write then rename, so a reader never sees a half-written file
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        with os.fdopen(fd, "w", encoding="utf-8") as f:
+            f.write(text)
+        os.chmod(tmp, 0o644)
+        os.replace(tmp, path)
+        return path
+
+
+def from_environment():
+    if os.environ.get("RESULTS_BUCKET"):
+        return S3Store(
+            os.environ["RESULTS_BUCKET"],
+            prefix=os.environ.get("RESULTS_PREFIX", "retrievals/"),
+            endpoint_url=os.environ.get("RESULTS_ENDPOINT_URL"),
+        )
+    if os.environ.get("RESULTS_DIR"):
+        return LocalStore(os.environ["RESULTS_DIR"])
+    return None
@@ -0,0 +1,129 @@
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from logs import get_logger
+
+logger = get_logger("retrieval_cache")
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_query(text):
+    return _WHITESPACE.sub(" ", text).strip().lower()
+
+
+def cache_key(query, knowledge_base_id, retrieval_configuration):
+    # the same query against a different knowledge base or search configuration is a different entry
+    key = json.dumps(
+        {"query": normalize_query(query), "kb": knowledge_base_id, "config": retrieval_configuration},
+        sort_keys=True,
+    )
+    return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+
+class MemoryCache:
+    """In-process LRU cache with a TTL; lives as long as the Lambda container."""
+
+    def __init__(self, max_entries=256, ttl=900):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class DynamoDBCache:
+    """Cache shared between containers in a DynamoDB (or DynamoDB-compatible) table.
+
+    The table needs a string partition key named `key`; enable DynamoDB TTL on `expires_at`
+    to have expired entries deleted, they are ignored on read either way.
+    """
+
+    def __init__(self, table_name, ttl=900, endpoint_url=None):
+        import boto3
+
+        self.table_name = table_name
+        self.ttl = ttl
+        self._client = boto3.client("dynamodb", endpoint_url=endpoint_url)
+
+    def get(self, key):
+        item = self._client.get_item(TableName=self.table_name, Key={"key": {"S": key}}).get("Item")
+        if item is None or int(item["expires_at"]["N"]) < time.time():
+            return None
+        return json.loads(item["value"]["S"])
+
+    def put(self, key, value):
+        self._client.put_item(
+            TableName=self.table_name,
+            Item={
+                "key": {"S": key},
+                "value": {"S": json.dumps(value, separators=(",", ":"))},
+                "expires_at": {"N": str(int(time.time() + self.ttl))},
+            },
+        )
+
+
+class RetrievalCache:
+    """Memory first, then the optional shared backend. Shared backend errors are logged and treated as misses."""
+
+    def __init__(self, memory, shared=None):
+        self.memory = memory
+        self.shared = shared
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        value = self.memory.get(key)
+        if value is None and self.shared is not None:
+            try:
+                value = self.shared.get(key)
+            except Exception as e:
+                logger.warning("Shared cache read failed: %s", e)
+            if value is not None:
+                self.memory.put(key, value)
+        if value is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return value
+
+    def put(self, key, value):
+        self.memory.put(key, value)
+        if self.shared is not None:
+            try:
+                self.shared.put(key, value)
+            except Exception as e:
+                # e.g. an item over DynamoDB's 400 KB limit; the memory copy still helps this container
+                logger.warning("Shared cache write failed: %s", e)
+
+
+def from_environment():
+    ttl = int(os.environ.get("CACHE_TTL_SECONDS", "900"))
+    memory = MemoryCache(max_entries=int(os.environ.get("CACHE_MAX_ENTRIES", "256")), ttl=ttl)
+    shared = None
+    if os.environ.get("CACHE_TABLE"):
+        shared = DynamoDBCache(os.environ["CACHE_TABLE"], ttl=ttl, endpoint_url=os.environ.get("CACHE_ENDPOINT_URL"))
+    return RetrievalCache(memory, shared)
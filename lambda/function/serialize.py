@@ -0,0 +1,58 @@
+import json
+
+# compact separators; ensure_ascii=False keeps non-ASCII text at its UTF-8 size instead of \uXXXX escapes
+_dumps = json.JSONEncoder(separators=(",", ":"), ensure_ascii=False).encode
+
+_SOURCE_URI_KEY = "x-amz-bedrock-kb-source-uri"
+
+
+def _source(result):
+    # the S3 URI and the metadata (mostly the DOI) are the same for every chunk from one PDF
+    location = result.get("location") or {}
+    uri = (location.get("s3Location") or {}).get("uri")
+    metadata = result.get("metadata") or {}
+    source = {"uri": uri or metadata.get(_SOURCE_URI_KEY)}
+    for key, value in metadata.items():
+        if key != _SOURCE_URI_KEY:
+            source[key] = value
+    return source
+
+
+def pack_results(results, max_bytes=20000, presorted=False, notes=None):
+    """Serializes retrievalResults as compact JSON of at most max_bytes (UTF-8).
+
+    Each distinct source (S3 URI plus metadata such as the DOI) is written once in "sources", and
+    results refer to it by index. Results are added whole, best score first, until the next one
+    would not fit; "omitted" counts the ones left out. With presorted the given order is kept instead.
+    notes are extra top-level fields. Returns (text, number of results included).
+    """
+    ordered = list(results or []) if presorted else sorted(results or [], key=lambda r: r.get("score") or 0, reverse=True)
+    notes = notes or {}
+
+    sources = []
+    source_index = {}
+    packed = []
+    # size of the envelope with the largest "omitted" count we could need
+    size = len(_dumps({"sources": [], "results": [], "omitted": len(ordered), **notes}).encode("utf-8"))
+
+    for result in ordered:
+        source = _source(result)
+        source_key = _dumps(source)
+        new_source = source_key not in source_index
+        index = len(sources) if new_source else source_index[source_key]
+        item = {"source": index, "score": round(result.get("score") or 0, 4), "text": (result.get("content") or {}).get("text", "")}
+
+        added = len(_dumps(item).encode("utf-8")) + (1 if packed else 0)
+        if new_source:
+            added += len(source_key.encode("utf-8")) + (1 if sources else 0)
+        if size + added > max_bytes:
+            break
+
+        size += added
+        if new_source:
+            source_index[source_key] = index
+            sources.append(source)
+        packed.append(item)
+
+    text = _dumps({"sources": sources, "results": packed, "omitted": len(ordered) - len(packed), **notes})
+    return text, len(packed)
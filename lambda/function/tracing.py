@@ -0,0 +1,116 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+
+class NoOpRecorder:
+    """Stands in for the X-Ray recorder when the SDK or the daemon is missing, e.g. in local runs."""
+
+    def begin_subsegment(self, name):
+        return None
+
+    def end_subsegment(self):
+        pass
+
+
+def xray_recorder():
+    # Lambda sets AWS_XRAY_DAEMON_ADDRESS when the function has active tracing; without it there is nothing to send to
+    if not os.environ.get("AWS_XRAY_DAEMON_ADDRESS"):
+        return NoOpRecorder()
+    try:
+        from aws_xray_sdk.core import patch, xray_recorder
+    except ImportError:
+        return NoOpRecorder()
+    # a subsegment per AWS API call, under whichever stage made it
+    patch(["botocore"])
+    return xray_recorder
+
+
+class Invocation:
+    """Stage timings and annotations for one invocation. A stage that runs more than once (one retrieve
+    per fan-out query, one pack per batch message) is reported as its total time and count, with
+    numeric annotations summed."""
+
+    def __init__(self, handler, request_id=None):
+        self.handler = handler
+        self.request_id = request_id
+        self.started = time.perf_counter()
+        self.stages = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, ms, annotations):
+        with self._lock:
+            stage = self.stages.setdefault(name, {"ms": 0.0, "count": 0})
+            stage["ms"] += ms
+            stage["count"] += 1
+            for key, value in annotations.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool) and key in stage:
+                    stage[key] += value
+                else:
+                    stage[key] = value
+
+    def summary(self):
+        with self._lock:
+            stages = {name: dict(stage, ms=round(stage["ms"], 1)) for name, stage in self.stages.items()}
+        return {
+            "handler": self.handler,
+            "requestId": self.request_id,
+            "totalMs": round((time.perf_counter() - self.started) * 1000, 1),
+            "stages": stages,
+        }
+
+
+class Span:
+    def __init__(self, subsegment):
+        self.subsegment = subsegment
+        self.annotations = {}
+
+    def annotate(self, key, value):
+        self.annotations[key] = value
+        if self.subsegment is not None:
+            self.subsegment.put_annotation(key, value)
+
+
+class Tracer:
+    """Times the stages of an invocation as X-Ray subsegments and as one JSON log line per invocation.
+
+    Lambda runs one invocation at a time per container, so the current invocation is kept on the
+    tracer and shared with the worker threads that retrieve on its behalf.
+    """
+
+    def __init__(self, recorder=None, emit=print):
+        self.recorder = recorder if recorder is not None else xray_recorder()
+        self.emit = emit
+        self.current = None
+
+    @contextmanager
+    def invocation(self, handler, context=None):
+        self.current = Invocation(handler, getattr(context, "aws_request_id", None))
+        try:
+            yield self.current
+        finally:
+            self.emit(json.dumps(self.current.summary(), separators=(",", ":")))
+            self.current = None
+
+    @contextmanager
+    def stage(self, name, **annotations):
+        subsegment = None
+        try:
+            subsegment = self.recorder.begin_subsegment(name)
+        except Exception:
+            # e.g. no segment to attach to outside an invocation; the timing is still logged
+            pass
+        span = Span(subsegment)
+        for key, value in annotations.items():
+            span.annotate(key, value)
+        start = time.perf_counter()
+        try:
+            yield span
+        finally:
+            ms = (time.perf_counter() - start) * 1000
+            if subsegment is not None:
+                self.recorder.end_subsegment()
+            if self.current is not None:
+                self.current.add(name, ms, span.annotations)
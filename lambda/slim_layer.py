@@ -0,0 +1,98 @@
+## trims the dependency layer built by 2-build-layer.sh down to what the function uses, and reports import time
+##
+##   python3 slim_layer.py package/python                # prune, precompile and report
+##   python3 slim_layer.py package/python --report-only  # just report import time for lambda_function
+
+import argparse
+import compileall
+import os
+import shutil
+import subprocess
+import sys
+
+# the botocore service models the function's clients need
+SERVICES = ["bedrock-agent-runtime", "dynamodb", "s3"]
+
+LAMBDA_RUNTIME = (3, 11)
+
+
+def dir_size(path):
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def prune(layer, services):
+    # botocore/data holds one directory per AWS service plus the shared endpoint and retry data files,
+    # which are kept; boto3/data only holds resource models, and the function only uses clients
+    data = os.path.join(layer, "botocore", "data")
+    for name in os.listdir(data):
+        path = os.path.join(data, name)
+        if os.path.isdir(path) and name not in services:
+            shutil.rmtree(path)
+    shutil.rmtree(os.path.join(layer, "boto3", "data"), ignore_errors=True)
+    # command line entry points aren't importable from a layer
+    shutil.rmtree(os.path.join(layer, "bin"), ignore_errors=True)
+
+
+def strip_pycache(layer):
+    for root, dirs, _ in os.walk(layer):
+        if "__pycache__" in dirs:
+            shutil.rmtree(os.path.join(root, "__pycache__"))
+            dirs.remove("__pycache__")
+
+
+def precompile(layer):
+    # bytecode is only used by the same Python version, so only precompile when building with the runtime's version
+    if sys.version_info[:2] != LAMBDA_RUNTIME:
+        print("Skipping precompile: building with Python {}.{}, the function runs {}.{}".format(*sys.version_info[:2], *LAMBDA_RUNTIME))
+        return
+    compileall.compile_dir(layer, quiet=1, workers=0)
+
+
+def report_import_time(layer, function_dir):
+    # -X importtime writes "import time: self [us] | cumulative | imported package" for every module to stderr
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([function_dir, layer]), AWS_DEFAULT_REGION="us-east-1")
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import lambda_function"],
+        env=env, capture_output=True, text=True,
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        # the name is indented two spaces per nesting level, after the single separator space
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        rows.append((int(cumulative), depth, name.strip()))
+    if result.returncode != 0 or not rows:
+        print(result.stderr)
+        raise SystemExit("Could not import lambda_function")
+
+    # a module's own imports are listed right before it, one level deeper
+    end = next(i for i, (_, depth, name) in enumerate(rows) if depth == 0 and name == "lambda_function")
+    start = end
+    while start > 0 and rows[start - 1][1] > 0:
+        start -= 1
+    children = sorted((us, name) for us, depth, name in rows[start:end] if depth == 1)
+    print("import lambda_function: {:.1f} ms".format(rows[end][0] / 1000))
+    for us, name in reversed(children[-8:]):
+        print("  {:>8.1f} ms {}".format(us / 1000, name))
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Trim the Lambda dependency layer and report import time")
+    parser.add_argument("layer", help="the layer's python/ directory, e.g. package/python")
+    parser.add_argument("--function", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "function"))
+    parser.add_argument("--service", action="append", help="botocore service models to keep (default: {})".format(", ".join(SERVICES)))
+    parser.add_argument("--report-only", action="store_true")
+    args = parser.parse_args()
+
+    if not args.report_only:
+        before = dir_size(args.layer)
+        prune(args.layer, args.service or SERVICES)
+        strip_pycache(args.layer)
+        precompile(args.layer)
+        print("layer: {:.1f} MB -> {:.1f} MB".format(before / 1e6, dir_size(args.layer) / 1e6))
+    report_import_time(args.layer, args.function)
@@ -0,0 +1,32 @@
+## the modules of lambda/function that the scripts at the repository root share with the lambda function
+##
+## they are deployed with the function, so they stay the one copy of its rules: which names a resource has and when a
+## text mentions one (relevance.py), and how a resource is phrased as a search (queries.py). This loads them from the
+## checkout rather than duplicating them, so they must not import boto3 or the function's other modules.
+
+import importlib
+import importlib.util
+import os
+
+_FUNCTION_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "lambda", "function")
+
+
+def _load(name):
+    try:
+        return importlib.import_module(name)
+    except ImportError:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(_FUNCTION_DIR, name + ".py"))
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return module
+
+
+relevance = _load("relevance")
+queries = _load("queries")
+
+NameScanner = relevance.NameScanner
+name_key = relevance.name_key
+name_pattern = relevance.name_pattern
+split_names = relevance.split_names
+build_query = queries.build_query
+name_queries = queries.name_queries
@@ -0,0 +1,88 @@
+## append-only JSONL ledger of extraction runs, so a crashed run can be restarted without redoing finished resources
+
+import json
+import os
+import threading
+from datetime import datetime, timezone
+
+PENDING = "pending"
+IN_PROGRESS = "in-progress"
+DONE = "done"
+FAILED = "failed"
+
+
+class RunLedger:
+    """Records the state of every resourceId in a run as one JSON line per state change.
+
+    The file is only ever appended to, so a crash can at worst lose the line being written.
+    On load the last entry for each resourceId wins.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._needs_newline = False
+        if os.path.exists(path):
+            self._load()
+
+    def _load(self):
+        with open(self.path) as f:
+            for line in f:
+                self._needs_newline = not line.endswith("\n")
+                line = line.strip()
+                if not line:
+                    continue
+                try:
+                    entry = json.loads(line)
+                except json.JSONDecodeError:
+                    # a half-written last line from a crash; everything before it is still valid
+                    continue
+                self._entries[entry["resourceId"]] = entry
+
+    def record(self, resourceId, state, turns=None, output=None, error=None):
+        entry = {
+            "resourceId": resourceId,
+            "state": state,
+            "turns": turns,
+            "output": output,
+            "error": error,
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+        }
+        line = json.dumps(entry) + "\n"
+        with self._lock:
+            if self._needs_newline:
+                # terminate the partial line so this entry starts on its own line
+                line = "\n" + line
+                self._needs_newline = False
+            with open(self.path, "a") as f:
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+            self._entries[resourceId] = entry
+        return entry
+
+    def seed(self, outputs):
+        """Marks done every (resourceId, output) not yet in the ledger, e.g. the files of runs from before it existed."""
+        seeded = 0
+        for resourceId, output in outputs:
+            if resourceId not in self._entries:
+                self.record(resourceId, DONE, output=output)
+                seeded += 1
+        return seeded
+
+    def state(self, resourceId):
+        entry = self._entries.get(resourceId)
+        return entry["state"] if entry else PENDING
+
+    def get(self, resourceId):
+        return self._entries.get(resourceId)
+
+    def is_done(self, resourceId):
+        return self.state(resourceId) == DONE
+
+    def summary(self):
+        counts = {}
+        for entry in self._entries.values():
+            counts[entry["state"]] = counts.get(entry["state"], 0) + 1
+        return counts
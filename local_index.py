@@ -0,0 +1,199 @@
+## a local BM25 search over the knowledge base PDFs, answering retrieve like the Bedrock knowledge base does
+##
+##   python local_index.py build ~/Downloads/nftc_pdfs_europe --output kb_index.pkl
+##   python local_index.py search kb_index.pkl "Tell me about NF1C-FiPS-SV4F7 Cell Line" -k 5
+##   NFTC_LOCAL_INDEX=kb_index.pkl python batch_retrieve.py --output /tmp/snapshot   # no AWS calls
+##
+## documents are the nftc_*.pdf files from get_knowledgebase_pdfs.R (text extraction needs pypdf) or already
+## extracted nftc_*.txt files, each with its <file>.metadata.json sidecar holding the DOI.
+
+import argparse
+import json
+import os
+import pickle
+import re
+from collections import Counter
+
+import numpy as np
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+_SOURCE_URI_KEY = "x-amz-bedrock-kb-source-uri"
+
+# where the knowledge base's documents live in S3, so results carry the same URIs as Bedrock's
+S3_PREFIX = "s3://nf-tools-database-publications/nftc_pdfs/"
+
+
+def tokenize(text):
+    # FTC-133 -> ftc, 133: the same split for documents and queries, so punctuation variants still meet
+    return _TOKEN.findall(text.lower())
+
+
+def extract_text(path):
+    if path.endswith(".txt"):
+        with open(path, encoding="utf-8") as f:
+            return f.read()
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ImportError("Indexing PDFs needs pypdf: pip install pypdf (or index extracted .txt files)")
+    return "\n".join(page.extract_text() or "" for page in PdfReader(path).pages)
+
+
+def read_metadata(path):
+    # the sidecar is {"metadataAttributes": {...}}; jsonlite writes each value as a one-element list
+    sidecar = path + ".metadata.json"
+    if not os.path.exists(sidecar):
+        sidecar = os.path.splitext(path)[0] + ".pdf.metadata.json"
+    if not os.path.exists(sidecar):
+        return {}
+    with open(sidecar, encoding="utf-8") as f:
+        data = json.load(f)
+    return data.get("metadataAttributes", data)
+
+
+def chunk_words(text, size=300, overlap=60):
+    """Splits text into windows of size words, each starting size - overlap words after the last."""
+    words = text.split()
+    step = max(1, size - overlap)
+    for start in range(0, max(1, len(words) - overlap), step):
+        chunk = words[start:start + size]
+        if chunk:
+            yield " ".join(chunk)
+
+
+class LocalIndex:
+    """An inverted index over the chunks of every document, scored with BM25.
+
+    Postings are kept per term as numpy arrays of chunk ids and term counts, so a query adds up
+    one vectorized BM25 term per query word.
+    """
+
+    def __init__(self, k1=1.2, b=0.75):
+        self.k1 = k1
+        self.b = b
+        self.chunks = []
+        self.sources = []
+        self.chunk_source = []
+        self.lengths = None
+        self.postings = {}
+
+    @classmethod
+    def build(cls, directory, chunk_size=300, overlap=60, s3_prefix=S3_PREFIX, **kwargs):
+        index = cls(**kwargs)
+        postings = {}
+        lengths = []
+        names = sorted(n for n in os.listdir(directory) if n.startswith("nftc_") and n.endswith((".pdf", ".txt")))
+        for name in names:
+            path = os.path.join(directory, name)
+            try:
+                text = extract_text(path)
+            except ImportError:
+                # without pypdf no PDF can be read; a single unreadable PDF is only skipped
+                raise
+            except Exception as e:
+                print(f"Skipping {name}: {e}")
+                continue
+            metadata = read_metadata(path)
+            pdf_name = os.path.splitext(name)[0] + ".pdf"
+            metadata[_SOURCE_URI_KEY] = s3_prefix + pdf_name
+            index.sources.append(metadata)
+            source = len(index.sources) - 1
+            for chunk in chunk_words(text, chunk_size, overlap):
+                chunk_id = len(index.chunks)
+                index.chunks.append(chunk)
+                index.chunk_source.append(source)
+                counts = Counter(tokenize(chunk))
+                lengths.append(sum(counts.values()))
+                for term, count in counts.items():
+                    postings.setdefault(term, ([], []))
+                    postings[term][0].append(chunk_id)
+                    postings[term][1].append(count)
+        index.lengths = np.asarray(lengths, dtype=np.float32)
+        index.chunk_source = np.asarray(index.chunk_source, dtype=np.int32)
+        index.postings = {
+            term: (np.asarray(ids, dtype=np.int32), np.asarray(counts, dtype=np.float32))
+            for term, (ids, counts) in postings.items()
+        }
+        return index
+
+    def save(self, path):
+        # the attributes only, so the file does not depend on where the class was imported from
+        with open(path, "wb") as f:
+            pickle.dump(vars(self), f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        # only load index files you built yourself: unpickling runs code
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        index = cls()
+        vars(index).update(state)
+        return index
+
+    def search(self, text, k=50):
+        """(chunk id, score) pairs for the k best chunks, best first."""
+        n = len(self.chunks)
+        if n == 0:
+            return []
+        avgdl = float(self.lengths.mean()) or 1.0
+        norm = self.k1 * (1 - self.b + self.b * self.lengths / avgdl)
+        scores = np.zeros(n, dtype=np.float32)
+        for term, weight in Counter(tokenize(text)).items():
+            if term not in self.postings:
+                continue
+            ids, tf = self.postings[term]
+            idf = np.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+            scores[ids] += weight * idf * tf * (self.k1 + 1) / (tf + norm[ids])
+        matched = np.flatnonzero(scores)
+        if len(matched) > k:
+            matched = matched[np.argpartition(scores[matched], -k)[-k:]]
+        ranked = matched[np.argsort(-scores[matched], kind="stable")]
+        return [(int(i), float(scores[i])) for i in ranked]
+
+    def result(self, chunk_id, score):
+        # the shape of one of retrieve's retrievalResults
+        metadata = self.sources[self.chunk_source[chunk_id]]
+        return {
+            "content": {"text": self.chunks[chunk_id]},
+            "location": {"type": "S3", "s3Location": {"uri": metadata[_SOURCE_URI_KEY]}},
+            "metadata": dict(metadata),
+            "score": round(score, 6),
+        }
+
+    def retrieve(self, text, k=50):
+        return [self.result(chunk_id, score) for chunk_id, score in self.search(text, k)]
+
+
+class LocalRetrieveClient:
+    """Answers client.retrieve(...) from a LocalIndex, so it can stand in for a bedrock-agent-runtime client."""
+
+    def __init__(self, index):
+        self.index = index
+
+    def retrieve(self, knowledgeBaseId=None, retrievalQuery=None, retrievalConfiguration=None, **kwargs):
+        k = ((retrievalConfiguration or {}).get("vectorSearchConfiguration") or {}).get("numberOfResults", 10)
+        return {"retrievalResults": self.index.retrieve(retrievalQuery["text"], k)}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query a local BM25 index of the knowledge base documents")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build", help="index a directory of nftc_*.pdf or nftc_*.txt files")
+    build.add_argument("directory")
+    build.add_argument("--output", required=True)
+    build.add_argument("--chunk-size", type=int, default=300, help="words per chunk")
+    build.add_argument("--overlap", type=int, default=60, help="words shared by consecutive chunks")
+    build.add_argument("--s3-prefix", default=S3_PREFIX)
+    search = commands.add_parser("search")
+    search.add_argument("index")
+    search.add_argument("query")
+    search.add_argument("-k", type=int, default=5)
+    args = parser.parse_args()
+
+    if args.command == "build":
+        index = LocalIndex.build(args.directory, chunk_size=args.chunk_size, overlap=args.overlap, s3_prefix=args.s3_prefix)
+        index.save(args.output)
+        print(f"{len(index.sources)} documents, {len(index.chunks)} chunks, {len(index.postings)} terms -> {args.output}")
+    else:
+        for result in LocalIndex.load(args.index).retrieve(args.query, args.k):
+            print(f"{result['score']:.3f} {result['metadata'].get('doi')} {result['content']['text'][:120]}")
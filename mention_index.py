@@ -0,0 +1,211 @@
+## where every resource name and synonym in the tools table is mentioned in the knowledge base documents
+##
+##   python mention_index.py build kb_index.pkl --tools tools.csv --output mentions.pkl   # or a directory of nftc_*.txt/.pdf
+##   python mention_index.py lookup mentions.pkl "FTC133" "SNF94.3" "SK-MEL-2"
+##   python mention_index.py check mentions.pkl data/combined_observations.csv --output /tmp/checked.csv
+##
+## names are matched by the lambda's rules (lambda/function/relevance.py): each letter or digit run of a name must appear
+## unbroken, but case and the punctuation or spacing between runs do not matter (FTC133 = FTC-133 = ftc 133, SK-MEL-2
+## also matches SKMEL2), two digit runs need a mark between them (NF90-8 is not "NF90 8"), and a mention must not run on
+## into another letter or digit (SK-MEL-2 is not found inside SK-MEL-238). Lookups are dictionary reads; check flags
+## observations whose text or cited paper never mentions their resource.
+
+import argparse
+import difflib
+import os
+import pickle
+import re
+import time
+
+import numpy as np
+import pandas as pd
+
+from convergence import normalize_doi
+from local_index import LocalIndex
+from lambda_modules import NameScanner, name_key, split_names
+from tools_table import load_tools_table
+
+_DIGITS = re.compile(r"[0-9]+")
+_NO_MENTIONS = np.empty((0, 3), dtype=np.int32)
+
+
+def _digits(key):
+    return tuple(_DIGITS.findall(key))
+
+
+class MentionIndex:
+    """For each name key (relevance.name_key), every place it occurs: rows of (chunk id, start, end) character
+    offsets in the chunk.
+
+    Chunk ids and sources are those of the LocalIndex the mentions were found in, so chunks() can pre-filter
+    its search results directly; mentions_in() runs the same matching over any other text.
+    """
+
+    def __init__(self):
+        self.resources = {}
+        self.names = {}
+        self.resource_keys = {}
+        self.mentions = {}
+        self.chunk_source = None
+        self.dois = []
+        self.uris = []
+        self._scanner = NameScanner([])
+        self._by_digits = {}
+
+    @classmethod
+    def build(cls, tools, local_index):
+        index = cls()
+        for row in tools.to_dict("records"):
+            keys = []
+            for name in split_names(row.get("resourceName"), row.get("synonyms")):
+                key = name_key(name)
+                if key and key not in keys:
+                    keys.append(key)
+                    index.resources.setdefault(key, []).append(row["resourceId"])
+                    index.names.setdefault(key, name)
+            index.resource_keys[row["resourceId"]] = keys
+        index._prepare()
+
+        found = {}
+        for chunk_id, chunk in enumerate(local_index.chunks):
+            for key, start, end in index.mentions_in(chunk):
+                found.setdefault(key, []).append((chunk_id, start, end))
+        index.mentions = {key: np.asarray(rows, dtype=np.int32) for key, rows in found.items()}
+        index.chunk_source = np.asarray(local_index.chunk_source, dtype=np.int32)
+        index.dois = [normalize_doi(source.get("doi")) for source in local_index.sources]
+        index.uris = [source.get("x-amz-bedrock-kb-source-uri") for source in local_index.sources]
+        return index
+
+    def _prepare(self):
+        # lookup tables derived from resources, rebuilt on load rather than pickled
+        self._scanner = NameScanner(self.resources)
+        self._by_digits = {}
+        for key in self.resources:
+            self._by_digits.setdefault(_digits(key), []).append(key)
+
+    def save(self, path):
+        state = {k: v for k, v in vars(self).items() if not k.startswith("_")}
+        with open(path, "wb") as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    @classmethod
+    def load(cls, path):
+        # only load index files you built yourself: unpickling runs code
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        index = cls()
+        vars(index).update(state)
+        index._prepare()
+        return index
+
+    def mentions_in(self, text, keys=None):
+        """(key, start, end) for every mention in text of an indexed name, or of the given name keys."""
+        scanner = self._scanner if keys is None else NameScanner(keys)
+        return scanner.scan(text)
+
+    def lookup(self, name):
+        """Every (chunk id, start, end) where the name occurs; spellings with the same runs (FTC-133, ftc 133) share it."""
+        return self.mentions.get(name_key(name), _NO_MENTIONS)
+
+    def fuzzy(self, name, cutoff=0.85):
+        """Indexed names matching name, best first, as (key, similarity): the name itself if indexed, otherwise
+        near spellings by the edit similarity of their letters and digits (so SKMEL2 finds SK-MEL-2 at 1.0),
+        but only among names with the same numbers, so SK-MEL-2 never comes back for SK-MEL-238."""
+        key = name_key(name)
+        if key in self.resources:
+            return [(key, 1.0)]
+        compact = key.replace(" ", "")
+        scored = []
+        for candidate in self._by_digits.get(_digits(key), []):
+            score = difflib.SequenceMatcher(None, compact, candidate.replace(" ", "")).ratio()
+            if score >= cutoff:
+                scored.append((candidate, round(score, 3)))
+        return sorted(scored, key=lambda c: c[1], reverse=True)[:5]
+
+    def resolve(self, name):
+        """The resourceIds a name (or a near spelling of it) belongs to."""
+        return sorted({r for key, _ in self.fuzzy(name) for r in self.resources[key]})
+
+    def chunks(self, resourceId=None, keys=None):
+        """The ids of the chunks that mention any name of the resource (or any of the name keys)."""
+        keys = [k for k in (keys if keys is not None else self.resource_keys.get(resourceId, [])) if k in self.mentions]
+        if not keys:
+            return np.empty(0, dtype=np.int32)
+        return np.unique(np.concatenate([self.mentions[k][:, 0] for k in keys]))
+
+    def dois_mentioning(self, resourceId=None, keys=None):
+        return {self.dois[s] for s in np.unique(self.chunk_source[self.chunks(resourceId, keys)]) if self.dois[s]}
+
+    def filter_results(self, results, resourceId):
+        """Keeps the RetrievalResults whose text mentions a name of the resource."""
+        scanner = NameScanner(self.resource_keys.get(resourceId, []))
+        return [r for r in results if scanner.scan(r.text)]
+
+
+def check_observations(observations, index):
+    """Adds nameInText, whether the observation text mentions its resource, and nameInDoi, whether the cited
+    paper does. Resources missing from the tools table are matched by the observation's resourceName; nameInDoi
+    is missing when the paper, or that name, was not indexed."""
+    df = observations.copy()
+    indexed = set(index.dois)
+    name_in_text = []
+    name_in_doi = []
+    for row in df.to_dict("records"):
+        keys = index.resource_keys.get(row["resourceId"])
+        if keys is None:
+            keys = [k for k in (name_key(n) for n in split_names(row.get("resourceName"))) if k]
+        text = row.get("observationText")
+        name_in_text.append(bool(index.mentions_in(text, keys)) if isinstance(text, str) and keys else None)
+        doi = normalize_doi(row.get("doi"))
+        searched = any(k in index.resources for k in keys)
+        name_in_doi.append(doi in index.dois_mentioning(keys=keys) if doi in indexed and searched else None)
+    df["nameInText"] = pd.array(name_in_text, dtype="boolean")
+    df["nameInDoi"] = pd.array(name_in_doi, dtype="boolean")
+    return df
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query an index of where resource names occur in the knowledge base")
+    commands = parser.add_subparsers(dest="command", required=True)
+    build = commands.add_parser("build")
+    build.add_argument("documents", help="a local_index.py index file, or a directory of nftc_*.pdf or nftc_*.txt files")
+    build.add_argument("--tools", help="CSV export of the tools table (default: NFTC_TOOLS_CSV, then Synapse)")
+    build.add_argument("--output", required=True)
+    lookup = commands.add_parser("lookup")
+    lookup.add_argument("index")
+    lookup.add_argument("names", nargs="+")
+    check = commands.add_parser("check", help="flag observations whose text or cited paper never mentions the resource")
+    check.add_argument("index")
+    check.add_argument("observations", help="CSV of observations, e.g. data/combined_observations.csv")
+    check.add_argument("--output", help="write the observations with nameInText and nameInDoi to this CSV")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        if os.path.isdir(args.documents):
+            local_index = LocalIndex.build(args.documents)
+        else:
+            local_index = LocalIndex.load(args.documents)
+        index = MentionIndex.build(load_tools_table(args.tools), local_index)
+        index.save(args.output)
+        mentioned = sum(1 for keys in index.resource_keys.values() if any(k in index.mentions for k in keys))
+        print(f"{len(index.resources)} names of {len(index.resource_keys)} resources, {mentioned} resources mentioned "
+              f"in {len(local_index.chunks)} chunks -> {args.output}")
+    elif args.command == "lookup":
+        index = MentionIndex.load(args.index)
+        for name in args.names:
+            start = time.perf_counter()
+            matches = index.fuzzy(name)
+            elapsed = (time.perf_counter() - start) * 1e6
+            print(f"{name}: {', '.join(f'{index.names[key]} ({score})' for key, score in matches) or 'no indexed name'} [{elapsed:.0f} us]")
+            for key, _ in matches:
+                rows = index.mentions.get(key, _NO_MENTIONS)
+                dois = sorted({index.dois[index.chunk_source[c]] for c in rows[:, 0]})
+                print(f"  {index.names[key]}: {len(rows)} mentions in {len(dois)} documents {', '.join(dois[:5])}")
+    else:
+        index = MentionIndex.load(args.index)
+        df = check_observations(pd.read_csv(args.observations), index)
+        print(f"{len(df)} observations: {(df['nameInText'] == False).sum()} never name their resource, "
+              f"{(df['nameInDoi'] == False).sum()} cite a paper that never mentions it, "
+              f"{df['nameInDoi'].isna().sum()} cite a paper (or name a resource) not in the index")
+        if args.output:
+            df.to_csv(args.output, index=False)
@@ -0,0 +1,44 @@
+## the observation record the agent returns, shared by agent.py and the output sinks
+
+from dataclasses import dataclass, fields
+from operator import attrgetter
+
+from pandas import DataFrame
+
+
+@dataclass(slots=True)
+class Observation:
+    """One observation as returned by the agent. List-valued fields (resourceType, observationType) are kept as lists."""
+
+    resourceId: object = None
+    resourceName: object = None
+    resourceType: object = None
+    observationText: object = None
+    observationType: object = None
+    observationPhase: object = None
+    observationTime: object = None
+    observationTimeUnits: object = None
+    doi: object = None
+
+    @classmethod
+    def from_dict(cls, d):
+        # keys outside the schema are dropped, missing keys are left as None
+        return cls(*(d.get(name) for name in OBSERVATION_FIELDS))
+
+
+OBSERVATION_FIELDS = tuple(f.name for f in fields(Observation))
+_as_row = attrgetter(*OBSERVATION_FIELDS)
+
+
+def to_records(parsed):
+    """Turns the agent's parsed JSON (a list of objects, a single object, or [null]) into Observations."""
+    if isinstance(parsed, dict):
+        parsed = [parsed]
+    if not isinstance(parsed, list):
+        return []
+    return [Observation.from_dict(item) for item in parsed if isinstance(item, dict)]
+
+
+def to_dataframe(observations):
+    # built once per resource; columns are always OBSERVATION_FIELDS, even when there are no observations
+    return DataFrame.from_records([_as_row(o) for o in observations], columns=OBSERVATION_FIELDS)
@@ -0,0 +1,121 @@
+## score and name-match report over a retrieval snapshot written by batch_retrieve.py
+##
+##   python retrieval_analytics.py /tmp/snapshot
+##   python retrieval_analytics.py /tmp/snapshot --target 0.9 --per-resource /tmp/per_resource.csv
+##
+## for every cutoff k it reports, averaged over the searches, how many of the top k chunks mention the resource,
+## what share of all the chunks (and DOIs) that mention it are within the top k, and the tokens the top k cost.
+## The best numberOfResults is the smallest k that keeps --target of the mentioning chunks.
+
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from convergence import normalize_doi
+from lambda_modules import name_pattern, split_names
+from prompts import CHARS_PER_TOKEN
+
+CUTOFFS = (1, 3, 5, 10, 15, 20, 25, 30, 40, 50, 75, 100)
+SEARCH = ["resourceId", "query"]
+
+
+def load_snapshot(path):
+    df = pd.read_parquet(path)
+    if "synonyms" not in df.columns:
+        df["synonyms"] = None
+    df["text"] = df["text"].fillna("")
+    df["doi"] = df["doi"].map(normalize_doi)
+    df["chars"] = df["text"].str.len().to_numpy(dtype=np.int64)
+    return df.sort_values(SEARCH + ["rank"], ignore_index=True)
+
+
+def add_name_match(df):
+    """Adds nameMatch: whether the chunk mentions the resource's name or one of its synonyms."""
+    match = np.zeros(len(df), dtype=bool)
+    # one regex per resource, run over all of that resource's chunks at once
+    for resourceId, index in df.groupby("resourceId", sort=False).indices.items():
+        first = df.iloc[index[0]]
+        # the lambda's own name matching (lambda/function/relevance.py)
+        pattern = name_pattern(split_names(first["resourceName"], first["synonyms"]))
+        if pattern is not None:
+            match[index] = df["text"].iloc[index].str.contains(pattern).to_numpy()
+    df["nameMatch"] = match
+    return df
+
+
+def score_distributions(df):
+    """Per resource and query kind: the score quantiles of the retrieved chunks, and how many mention the resource."""
+    grouped = df.groupby(["resourceId", "resourceName", "queryKind"], sort=False)
+    scores = grouped["score"].describe(percentiles=[0.25, 0.5, 0.75])[["count", "min", "25%", "50%", "75%", "max"]]
+    scores["matched"] = grouped["nameMatch"].sum()
+    scores["matchedDois"] = df[df["nameMatch"]].groupby(["resourceId", "resourceName", "queryKind"], sort=False)["doi"].nunique()
+    scores["matchedDois"] = scores["matchedDois"].fillna(0).astype(int)
+    # the best rank at which a chunk mentions the resource, NaN if none does
+    scores["firstMatchRank"] = df[df["nameMatch"]].groupby(["resourceId", "resourceName", "queryKind"], sort=False)["rank"].min()
+    return scores.reset_index()
+
+
+def cutoff_curve(df, cutoffs=CUTOFFS):
+    """For each cutoff k, averages over searches: precision (share of the top k that mention the resource),
+    recall and DOI recall (share of the mentioning chunks, and of their DOIs, that are in the top k), and tokens."""
+    matched = df[df["nameMatch"]]
+    total = matched.groupby(SEARCH).size()
+    total_dois = matched.groupby(SEARCH)["doi"].nunique()
+    searches = df.groupby(SEARCH).size().index
+    deepest = int(df["rank"].max())
+
+    rows = []
+    for k in [k for k in cutoffs if k <= deepest] or [deepest]:
+        top = df[df["rank"].to_numpy() <= k]
+        kept = top.groupby(SEARCH).size().reindex(searches, fill_value=0)
+        top_matched = top[top["nameMatch"]]
+        hits = top_matched.groupby(SEARCH).size().reindex(total.index, fill_value=0)
+        dois = top_matched.groupby(SEARCH)["doi"].nunique().reindex(total_dois.index, fill_value=0)
+        chars = top.groupby(SEARCH)["chars"].sum().reindex(searches, fill_value=0)
+        rows.append({
+            "k": k,
+            "precision": float((top.groupby(SEARCH)["nameMatch"].sum().reindex(searches, fill_value=0) / kept.clip(lower=1)).mean()),
+            "recall": float((hits / total).mean()) if len(total) else np.nan,
+            "doiRecall": float((dois / total_dois).mean()) if len(total_dois) else np.nan,
+            "tokens": float(chars.mean() / CHARS_PER_TOKEN),
+        })
+    return pd.DataFrame(rows)
+
+
+def best_cutoff(curve, target=0.95, column="recall"):
+    """The smallest k whose average recall reaches target, or the deepest k if none does."""
+    reached = curve[curve[column] >= target]
+    return int(reached["k"].iloc[0] if len(reached) else curve["k"].iloc[-1])
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report retrieval scores and name matches over a retrieval snapshot")
+    parser.add_argument("snapshot", help="directory (or file) written by batch_retrieve.py")
+    parser.add_argument("--target", type=float, default=0.95, help="share of mentioning chunks the cutoff must keep")
+    parser.add_argument("--query-kind", help="only searches of this kind, e.g. combined (what the agent sends)")
+    parser.add_argument("--per-resource", help="write the per-resource score distributions to this CSV")
+    args = parser.parse_args()
+
+    df = add_name_match(load_snapshot(args.snapshot))
+    if args.query_kind:
+        df = df[df["queryKind"] == args.query_kind]
+    searches = df.groupby(SEARCH).ngroups
+    resources = df["resourceId"].nunique()
+    print(f"{len(df)} chunks from {searches} searches for {resources} resources")
+
+    per_resource = score_distributions(df)
+    unmatched = int((per_resource.groupby("resourceId")["matched"].sum() == 0).sum())
+    print(f"{df['nameMatch'].mean():.1%} of chunks mention their resource; {unmatched} of {resources} resources have no chunk that does")
+    print(f"score of mentioning chunks: median {df.loc[df['nameMatch'], 'score'].median():.3f}, others {df.loc[~df['nameMatch'], 'score'].median():.3f}")
+
+    curve = cutoff_curve(df)
+    print(curve.to_string(index=False, float_format=lambda v: f"{v:.3f}"))
+    k = best_cutoff(curve, args.target)
+    at_k = curve[curve["k"] == k].iloc[0]
+    deepest = curve.iloc[-1]
+    print(f"numberOfResults={k} keeps {at_k['recall']:.1%} of mentioning chunks and {at_k['doiRecall']:.1%} of their DOIs "
+          f"for {at_k['tokens']:.0f} tokens per search, versus {deepest['tokens']:.0f} at {int(deepest['k'])}")
+
+    if args.per_resource:
+        per_resource.to_csv(args.per_resource, index=False)
@@ -0,0 +1,124 @@
+## output sinks for extracted observations: one CSV per resource, or batched row groups in Parquet files
+
+import math
+import os
+import threading
+from datetime import datetime, timezone
+
+from observations import OBSERVATION_FIELDS
+
+
+class CsvSink:
+    """Writes observation_<resourceId>.csv per resource, the layout combine_observations.R reads."""
+
+    def __init__(self, output_dir, on_written=None):
+        self.output_dir = output_dir
+        self.on_written = on_written
+        os.makedirs(output_dir, exist_ok=True)
+
+    def write(self, resourceId, response, **meta):
+        output = os.path.join(self.output_dir, f'observation_{resourceId}.csv')
+        response.to_csv(output, index=False)
+        if self.on_written is not None:
+            self.on_written(resourceId, output, **meta)
+
+    def close(self):
+        pass
+
+
+def _to_cell(value):
+    # store every column as text, rendered the way the CSV files render it, so one schema fits every resource
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return None
+    return str(value)
+
+
+def import_pyarrow(needed_for):
+    try:
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+    except ImportError:
+        raise ImportError(f"{needed_for} needs pyarrow: pip install pyarrow")
+    return pa, pq
+
+
+class PartFileWriter:
+    """Buffers rows from many resources and writes them out in batches as Parquet part files.
+
+    Each flush writes one complete <prefix>-<run>-<part>.parquet with the given pyarrow schema under
+    output_dir, so the whole directory loads with a single pandas.read_parquet(output_dir) and a crash
+    only loses the batch being buffered. on_written is called for a resource once its rows are on disk.
+    """
+
+    def __init__(self, output_dir, schema, prefix, on_written=None, batch_rows=1000):
+        self._pa, self._pq = import_pyarrow("Parquet output")
+        self.schema = schema
+        self.columns = list(schema.names)
+        self.prefix = prefix
+        self.output_dir = output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        self.run = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%S")
+        self.on_written = on_written
+        self.batch_rows = batch_rows
+        self._part = 0
+        self._reset()
+        self._lock = threading.Lock()
+
+    def _reset(self):
+        self._buffer = {column: [] for column in self.columns}
+        self._buffered = 0
+        self._pending = []
+
+    def append(self, resourceId, columns, **meta):
+        """Buffers one resource's rows, given as a list of values per column; flushes once batch_rows are buffered."""
+        n = len(columns[self.columns[0]])
+        with self._lock:
+            for column in self.columns:
+                self._buffer[column].extend(columns[column])
+            self._buffered += n
+            self._pending.append((resourceId, meta))
+            if self._buffered >= self.batch_rows:
+                self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        output = os.path.join(self.output_dir, f"{self.prefix}-{self.run}-{self._part:05d}.parquet")
+        table = self._pa.Table.from_pydict(self._buffer, schema=self.schema)
+        self._pq.write_table(table, output)
+        self._part += 1
+        pending = self._pending
+        self._reset()
+        if self.on_written is not None:
+            for resourceId, meta in pending:
+                self.on_written(resourceId, output, **meta)
+
+    def close(self):
+        with self._lock:
+            self._flush()
+
+
+class ParquetSink(PartFileWriter):
+    """Writes observations as observations-<run>-<part>.parquet part files (see PartFileWriter).
+
+    Rows carry resourceId_reference, the resource the agent was asked about, like combined_observations.csv.
+    """
+
+    def __init__(self, output_dir, on_written=None, batch_rows=1000):
+        pa, _ = import_pyarrow("The parquet output format")
+        columns = list(OBSERVATION_FIELDS) + ["resourceId_reference"]
+        schema = pa.schema([(column, pa.string()) for column in columns])
+        super().__init__(output_dir, schema, "observations", on_written=on_written, batch_rows=batch_rows)
+
+    def write(self, resourceId, response, **meta):
+        columns = {column: [_to_cell(v) for v in response[column].tolist()] for column in OBSERVATION_FIELDS}
+        columns["resourceId_reference"] = [resourceId] * len(response)
+        self.append(resourceId, columns, **meta)
+
+
+def make_sink(output_format, output_dir, on_written=None, **kwargs):
+    if output_format == "csv":
+        return CsvSink(output_dir, on_written=on_written)
+    if output_format == "parquet":
+        return ParquetSink(output_dir, on_written=on_written, **kwargs)
+    raise ValueError(f"Unknown output format {output_format!r}, expected 'csv' or 'parquet'")
@@ -0,0 +1,156 @@
+## shared rate limiting and retry for Bedrock calls made from several worker threads
+
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from botocore.exceptions import ClientError, ConnectTimeoutError, EndpointConnectionError
+from botocore.exceptions import ReadTimeoutError as BotocoreReadTimeoutError
+from urllib3.exceptions import ReadTimeoutError
+
+logger = logging.getLogger(__name__)
+
+# error codes are compared lowercased: invoke_agent reports 'throttlingException' inside the event stream
+# and 'ThrottlingException' on the initial request
+THROTTLING_CODES = {
+    "throttlingexception",
+    "toomanyrequestsexception",
+    "servicequotaexceededexception",
+}
+TRANSIENT_CODES = {
+    "internalserverexception",
+    "serviceunavailableexception",
+    "serviceunavailable",
+    "dependencyfailedexception",
+    "badgatewayexception",
+    "modelnotreadyexception",
+}
+
+
+def error_code(e):
+    if isinstance(e, ClientError):
+        return e.response.get("Error", {}).get("Code", "").lower()
+    return ""
+
+
+def is_throttle(e):
+    return error_code(e) in THROTTLING_CODES
+
+
+def is_retryable(e):
+    if is_throttle(e) or error_code(e) in TRANSIENT_CODES:
+        return True
+    return isinstance(e, (ReadTimeoutError, BotocoreReadTimeoutError, ConnectTimeoutError, EndpointConnectionError, TimeoutError))
+
+
+class TokenBucket:
+    """Allows `rate` calls per second on average, with bursts of up to `capacity` calls."""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class AdaptiveConcurrency:
+    """AIMD limit on the number of calls in flight.
+
+    Every success adds 1/limit (so roughly +1 per limit successes), every throttle multiplies the
+    limit by `decrease`. Callers over the current limit wait for a slot.
+    """
+
+    def __init__(self, maximum, minimum=1, initial=None, decrease=0.5):
+        self.maximum = maximum
+        self.minimum = minimum
+        self.decrease = decrease
+        self.limit = float(initial if initial is not None else maximum)
+        self._in_flight = 0
+        self._cond = threading.Condition()
+
+    @contextmanager
+    def slot(self):
+        with self._cond:
+            while self._in_flight >= int(self.limit):
+                self._cond.wait()
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._in_flight -= 1
+                self._cond.notify_all()
+
+    def on_success(self):
+        with self._cond:
+            self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+            self._cond.notify_all()
+
+    def on_throttle(self):
+        with self._cond:
+            self.limit = max(self.minimum, self.limit * self.decrease)
+            logger.warning(f"Throttled, reducing concurrency limit to {int(self.limit)}")
+
+
+class RetryBudget:
+    """Caps the total number of retries across a whole run, so an outage can't turn into endless backoff."""
+
+    def __init__(self, retries):
+        self.remaining = retries
+        self._lock = threading.Lock()
+
+    def spend(self):
+        with self._lock:
+            if self.remaining <= 0:
+                return False
+            self.remaining -= 1
+            return True
+
+
+def call_with_retry(fn, bucket=None, limiter=None, budget=None, max_attempts=6, base_delay=1.0, max_delay=60.0):
+    """Calls fn() under the shared limits, retrying throttling and transient errors with full-jitter backoff.
+
+    Non-retryable errors, and retryable ones once max_attempts or the run's retry budget is used up,
+    are re-raised to the caller.
+    """
+    attempt = 0
+    while True:
+        if bucket is not None:
+            bucket.acquire()
+        try:
+            if limiter is not None:
+                with limiter.slot():
+                    result = fn()
+            else:
+                result = fn()
+        except Exception as e:
+            if not is_retryable(e):
+                raise
+            if limiter is not None and is_throttle(e):
+                limiter.on_throttle()
+            attempt += 1
+            if attempt >= max_attempts or (budget is not None and not budget.spend()):
+                logger.error(f"Giving up after {attempt} attempts. {e}")
+                raise
+            delay = random.uniform(0, min(max_delay, base_delay * 2 ** attempt))
+            logger.info(f"Retrying in {delay:.1f}s (attempt {attempt + 1} of {max_attempts}). {e}")
+            time.sleep(delay)
+            continue
+        if limiter is not None:
+            limiter.on_success()
+        return result
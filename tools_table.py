@@ -0,0 +1,30 @@
+## the NF Research Tools table of resources to extract observations for, from Synapse or a CSV export
+
+import os
+
+from pandas import read_csv
+
+
+def given(value):
+    # cells are strings, lists (from Synapse) or missing, which iterrows turns into nan even where the table has None
+    if isinstance(value, str):
+        return value != '' and value != 'nan'
+    return isinstance(value, (list, tuple)) and len(value) > 0
+
+
+def load_tools_table(tools_csv=None):
+    # a CSV export of the tools table (tools_csv or NFTC_TOOLS_CSV) is read instead, e.g. for offline runs against fake_bedrock.py
+    tools_csv = tools_csv or os.environ.get("NFTC_TOOLS_CSV")
+    if tools_csv:
+        df = read_csv(tools_csv, dtype=str)
+        return df.astype(object).where(df.notna(), None)
+
+    import synapseclient
+
+    syn = synapseclient.Synapse()
+    syn.login()
+
+    ## Get table data from synapse SELECT resourceId, resourceName, synonyms FROM syn26450069 where resourceType is Animal Model or Cell Line
+    query = "SELECT resourceId, resourceName, resourceType, rrid, synonyms FROM syn26450069 where resourceType in ('Animal Model', 'Cell Line')"
+    results = syn.tableQuery(query, includeRowIdAndRowVersion=False)
+    return results.asDataFrame()